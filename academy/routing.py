@@ -2,7 +2,14 @@ from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
 
 import chat.routing
+import games.routing
 
 application = ProtocolTypeRouter(
-    {"websocket": AuthMiddlewareStack(URLRouter(chat.routing.websocket_urlpatterns)),}
+    {
+        "websocket": AuthMiddlewareStack(
+            URLRouter(
+                chat.routing.websocket_urlpatterns + games.routing.websocket_urlpatterns
+            )
+        ),
+    }
 )
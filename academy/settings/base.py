@@ -41,7 +41,7 @@ INSTALLED_APPS = [
     "django_celery_beat",
     "svelte",
     "chat",
-    "games",
+    "games.apps.GamesConfig",
     "web",
 ]
 
@@ -12,6 +12,9 @@ EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
 PLAY_URL = "http://localhost:4200"
 
+# There is no broker in development, so tasks are run when they are sent
+CELERY_TASK_ALWAYS_EAGER = True
+
 AUTOLOGIN_USERNAME = os.environ.get("AUTOLOGIN_USERNAME")
 
 if sys.argv[1:2] != ["test"]:
@@ -71,5 +71,6 @@ LOGGING = {
         },
         # Might as well log any errors anywhere else in Django
         "django": {"handlers": ["logfile"], "level": "ERROR", "propagate": False},
+        "games": {"handlers": ["logfile"], "level": "ERROR", "propagate": False},
     },
 }
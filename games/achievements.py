@@ -1,9 +1,20 @@
 import datetime
 
 import pytz
+from django.db import transaction
 from django.db.models import Q
-
-from .models import Game, PlayerStat, Season, all_time_season
+from django.utils import timezone
+
+from .models import (
+    Game,
+    GamePlayer,
+    PlayerStat,
+    RankingEntry,
+    Season,
+    User,
+    UserAchievement,
+    all_time_season,
+)
 
 ACHIEVEMENTS = []
 
@@ -16,65 +27,70 @@ class AchievementMetaClass(type):
 
 
 class Achievement(metaclass=AchievementMetaClass):
-    __slots__ = ["name", "description", "icon"]
+    __slots__ = ["key", "name", "description", "icon"]
+
+    # Whether a game can change the achievement for users not in the game
+    affects_other_users = False
 
     @staticmethod
-    def has_achieved(user):
+    def filter_users(users):
+        """
+        Returns the users of the queryset, that have the achievement.
+        """
         raise NotImplementedError
 
+    @classmethod
+    def has_achieved(cls, user):
+        return cls.filter_users(User.objects.filter(id=user.id)).exists()
+
 
 class DNFAchievement(Achievement):
+    key = "dnf"
     name = "DNF"
     description = "Participated in a game that completed, where you didn't"
     icon = "coffin"
 
-    def has_achieved(user):
-        return (
-            user.gameplayer_set.filter(dnf=True)
-            .filter(game__dnf=False, game__end_datetime__isnull=False)
-            .exists()
+    def filter_users(users):
+        return users.filter(
+            id__in=GamePlayer.objects.filter(
+                dnf=True, game__dnf=False, game__end_datetime__isnull=False
+            ).values("user_id")
         )
 
 
 class Top10Achievement(Achievement):
+    key = "top_10"
     name = "Top 10"
     description = "Placed top 10 total sips in a season"
     icon = "trophy-cup"
+    affects_other_users = True
 
-    def has_achieved(user):
-        current_season = Season.current_season()
-        for i in range(1, current_season.number + 1):
-            top10 = (
-                PlayerStat.objects.filter(season_number=i)
-                .order_by("-total_sips")[:10]
-                .values("user")
-            )
-            if {"user": user.id} in top10:
-                return True
-
-        return False
+    def filter_users(users):
+        top10 = RankingEntry.objects.filter(
+            key="total_sips", season_number__gte=1, rank__lte=10
+        )
+        return users.filter(id__in=top10.values("user_id"))
 
 
 class FastGameAchievement(Achievement):
+    key = "fast_game"
     name = "Fast Game"
     description = "Finished a game in less than 30 minutes"
     icon = "stopwatch"
 
-    def has_achieved(user):
-        return (
-            Game.add_durations(
-                Game.objects.filter(
-                    gameplayer__in=user.gameplayer_set.filter(dnf=False).filter(
-                        game__dnf=False
-                    )
-                )
+    def filter_users(users):
+        fast_games = Game.add_durations(Game.objects.filter(dnf=False)).filter(
+            duration__lt=datetime.timedelta(minutes=30)
+        )
+        return users.filter(
+            id__in=GamePlayer.objects.filter(dnf=False, game__in=fast_games).values(
+                "user_id"
             )
-            .filter(duration__lt=datetime.timedelta(minutes=30))
-            .exists()
         )
 
 
 class DanishDSTAchievement(Achievement):
+    key = "dst"
     name = "DST"
     description = "Participated in a game, while a DST transition happened in Denmark"
     icon = "backward-time"
@@ -86,36 +102,92 @@ class DanishDSTAchievement(Achievement):
             pytz.timezone("Europe/Copenhagen")._utc_transition_times[1:],
         )
 
-    def has_achieved(user):
-        query = Q()
+    def filter_users(users):
+        # No games were played before the first season
+        first_datetime = Season(1).start_datetime
+        now = timezone.now()
+
+        query = Q(pk__in=[])
         for dt in DanishDSTAchievement.get_transition_times():
-            query |= Q(start_datetime__lt=dt, end_datetime__gt=dt)
+            if first_datetime <= dt <= now:
+                query |= Q(start_datetime__lt=dt, end_datetime__gt=dt)
 
-        return user.games.filter(query).exists()
+        return users.filter(
+            id__in=GamePlayer.objects.filter(
+                game__in=Game.objects.filter(query)
+            ).values("user_id")
+        )
+
+
+def filter_all_time_stats(users, **kwargs):
+    return users.filter(
+        id__in=PlayerStat.objects.filter(
+            season_number=all_time_season.number, **kwargs
+        ).values("user_id")
+    )
 
 
 class TheBarrelAchievement(Achievement):
+    key = "the_barrel"
     name = "The Barrel"
     description = "Consumed 100 beers in-game"
     icon = "barrel"
 
-    def has_achieved(user):
-        return (user.stats_for_season(all_time_season).total_sips / 14) >= 100
+    def filter_users(users):
+        return filter_all_time_stats(users, total_sips__gte=100 * 14)
 
 
 class BundeCampAchievement(Achievement):
+    key = "chug_camp"
     name = "Chug Camp"
     description = "Got 50 chugs in-game"
     icon = "ace"
 
-    def has_achieved(user):
-        return user.stats_for_season(all_time_season).total_chugs >= 50
+    def filter_users(users):
+        return filter_all_time_stats(users, total_chugs__gte=50)
 
 
 class StudyHardAchievement(Achievement):
+    key = "study_hard"
     name = "Study Hard"
     description = f"Spend at least the amount of time corresponding to 2.5 ECTS in game (56 hours)"
     icon = "diploma"
 
-    def has_achieved(user):
-        return user.stats_for_season(all_time_season).approx_ects >= 2.5
+    def filter_users(users):
+        return filter_all_time_stats(
+            users,
+            total_time_played_seconds__gte=2.5 * PlayerStat.HOURS_PER_ECTS * 60 * 60,
+        )
+
+
+@transaction.atomic
+def evaluate_achievements(users=None):
+    """
+    Stores which of the users (all if None) have each of the achievements.
+    """
+    all_users = User.objects.all()
+    if users is None:
+        users = all_users
+    else:
+        users = User.objects.filter(id__in=[user.id for user in users])
+
+    for achievement in ACHIEVEMENTS:
+        scope = all_users if achievement.affects_other_users else users
+        achieved = achievement.filter_users(scope)
+
+        existing = UserAchievement.objects.filter(key=achievement.key, user__in=scope)
+        existing.exclude(user__in=achieved).delete()
+
+        existing_ids = set(existing.values_list("user_id", flat=True))
+        UserAchievement.objects.bulk_create(
+            (
+                UserAchievement(user_id=user_id, key=achievement.key)
+                for user_id in achieved.values_list("id", flat=True)
+                if user_id not in existing_ids
+            ),
+            batch_size=1000,
+        )
+
+
+def evaluate_achievements_on_game_finished(game):
+    evaluate_achievements(game.players.all())
@@ -10,7 +10,7 @@ from django.utils.decorators import method_decorator
 from django.utils.html import format_html
 from django.views.generic import CreateView, FormView
 
-from .models import Card, Chug, Game, GamePlayer, User
+from .models import Card, Chug, Game, GamePlayer, GameSnapshot, User
 from .serializers import GameSerializer
 from .views import update_game
 
@@ -165,6 +165,7 @@ class UploadForm(forms.ModelForm):
         game.dnf = False
         game.save()
         update_game(game, self.cleaned_data["validated_data"])
+        GameSnapshot.invalidate([game])
         return game
 
     def save_m2m(self):
@@ -184,3 +185,7 @@ class GameAdmin(admin.ModelAdmin):
         else:
             self.inlines = [GamePlayerInline, CardInline]
             return super().get_form(request, obj, **kwargs)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        GameSnapshot.invalidate([form.instance])
@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class GamesConfig(AppConfig):
     name = "games"
+
+    def ready(self):
+        from .search import ensure_user_search_triggers
+
+        post_migrate.connect(ensure_user_search_triggers, sender=self)
@@ -0,0 +1,59 @@
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+@contextmanager
+def benchmark_database():
+    """
+    Runs the block against a new test database,
+    which is destroyed afterwards.
+    """
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+class Measurement:
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.queries = 0
+        self.wall_seconds = None
+        self.peak_memory_bytes = None
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def as_dict(self):
+        return {
+            "queries": self.queries,
+            "wall_seconds": self.wall_seconds,
+            "peak_memory_bytes": self.peak_memory_bytes,
+        }
+
+
+@contextmanager
+def measure(trace_memory=False):
+    """
+    Measures the number of queries, the wall time and optionally
+    the peak memory allocated by Python while running the block.
+    """
+    m = Measurement(trace_memory)
+    if trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(m.count_query):
+            yield m
+    finally:
+        m.wall_seconds = time.perf_counter() - start
+        if trace_memory:
+            m.peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
@@ -0,0 +1,48 @@
+import hashlib
+
+from django.db.models import Max
+
+from .models import Game, Season, User, get_stats_version
+
+
+def make_etag(*parts):
+    # Weak, as the same version may be sent with different encodings
+    return 'W/"' + "-".join(str(p) for p in parts) + '"'
+
+
+def get_game_etag(request, pk):
+    """
+    The version of the game changes whenever its data changes, see Game.save.
+    """
+    version = Game.objects.filter(pk=pk).values_list("version", flat=True).first()
+    if version is None:
+        return None
+
+    return make_etag("game", pk, version)
+
+
+def get_live_games_etag(request):
+    live_game_ids = Game.objects.filter(end_datetime__isnull=True, dnf=False)
+    digest = hashlib.md5(
+        ",".join(str(id) for id in live_game_ids.values_list("id", flat=True)).encode()
+    ).hexdigest()
+    return make_etag("live", digest)
+
+
+def get_stats_etag(request, *args, **kwargs):
+    """
+    The ETag of responses derived from the stats, which only change when games
+    finish, and the users, whose names and images are shown.
+    Includes the current season, used when no season is chosen,
+    and the current user, shown in the navigation of pages.
+    """
+    users_updated_at = User.objects.aggregate(updated_at=Max("updated_at"))[
+        "updated_at"
+    ]
+    return make_etag(
+        "stats",
+        get_stats_version(),
+        Season.current_season().number,
+        users_updated_at.timestamp() if users_updated_at else 0,
+        request.user.id,
+    )
@@ -0,0 +1,32 @@
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .live import get_game_group_name
+
+
+class GameConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Sends the updates of a live game to its spectators.
+    """
+
+    async def connect(self):
+        self.game_group_name = get_game_group_name(
+            self.scope["url_route"]["kwargs"]["game_id"]
+        )
+
+        await self.channel_layer.group_add(self.game_group_name, self.channel_name)
+
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(self.game_group_name, self.channel_name)
+
+    async def receive_json(self, content):
+        # Spectators only receive updates
+        pass
+
+    async def game_update(self, event):
+        # Make a copy as we can't remove type from the received event or dispatching will fail
+        event = dict(event)
+
+        del event["type"]
+        await self.send_json(event)
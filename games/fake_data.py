@@ -0,0 +1,289 @@
+import datetime
+from random import Random
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Card, Chug, Game, GameHashtag, GamePlayer, Season, User
+from .search import hashtags_for_game
+from .seed import generate_seed_for_players
+
+
+def next_id(model):
+    return (model.objects.aggregate(max_id=Max("id"))["max_id"] or 0) + 1
+
+
+def reset_sequences(*models):
+    # Needed on PostgreSQL after inserting rows with explicit ids
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
+
+
+def chunks(n, chunk_size):
+    for start in range(0, n, chunk_size):
+        yield start, min(chunk_size, n - start)
+
+
+def create_fake_users(count, prefix="fake_user_", chunk_size=1000):
+    """
+    Creates count users, which can't log in.
+    """
+    password = make_password(None)
+    first_id = next_id(User)
+    for start, size in chunks(count, chunk_size):
+        User.objects.bulk_create(
+            User(
+                id=first_id + i, username=f"{prefix}{first_id + i}", password=password,
+            )
+            for i in range(start, start + size)
+        )
+
+    reset_sequences(User)
+    return list(User.objects.filter(id__gte=first_id).order_by("id"))
+
+
+class FakeGameGenerator:
+    """
+    Generates games with valid seeds and card orders,
+    inserting them with a few bulk_create calls per chunk of games.
+
+    Explicit ids are used, as bulk_create doesn't return them on every backend.
+    """
+
+    MIN_TURN_MS = 5 * 1000
+    MAX_TURN_MS = 90 * 1000
+    MIN_CHUG_MS = 3 * 1000
+    MAX_CHUG_MS = 30 * 1000
+
+    # Around Aarhus and Copenhagen
+    LOCATIONS = [(56.16, 10.20), (55.68, 12.57)]
+    WORDS = ["hygge", "sad", "fast", "slow", "cold", "warm", "beer", "game"]
+    HASHTAGS = ["#academy", "#rusdag", "#fredagsbar", "#eksamen", "#sommer"]
+
+    def __init__(
+        self,
+        users,
+        random_seed=None,
+        first_datetime=None,
+        last_datetime=None,
+        dnf_ratio=0.03,
+        location_ratio=0.5,
+        description_ratio=0.3,
+    ):
+        self.users = list(users)
+        self.usernames = {user.id: user.username for user in self.users}
+        self.random = Random(random_seed)
+        self.dnf_ratio = dnf_ratio
+        self.location_ratio = location_ratio
+        self.description_ratio = description_ratio
+        self.first_datetime = first_datetime or Season(1).start_datetime
+        self.last_datetime = last_datetime or timezone.now() - datetime.timedelta(
+            days=1
+        )
+
+        self.game_id = next_id(Game)
+        self.gameplayer_id = next_id(GamePlayer)
+        self.card_id = next_id(Card)
+        self.chug_id = next_id(Chug)
+
+    def random_datetime(self):
+        span = (self.last_datetime - self.first_datetime).total_seconds()
+        return self.first_datetime + datetime.timedelta(
+            seconds=self.random.uniform(0, span)
+        )
+
+    def random_location(self):
+        latitude, longitude = self.random.choice(self.LOCATIONS)
+        return {
+            "location_latitude": latitude + self.random.uniform(-0.05, 0.05),
+            "location_longitude": longitude + self.random.uniform(-0.05, 0.05),
+            "location_accuracy": self.random.uniform(5, 100),
+        }
+
+    def random_description(self):
+        words = self.random.sample(self.WORDS, self.random.randint(1, 4))
+        words += self.random.sample(self.HASHTAGS, self.random.randint(1, 2))
+        self.random.shuffle(words)
+        return " ".join(words)
+
+    def generate_game(self, live=False):
+        """
+        Generates a game, that is either finished, dnf or live.
+        Live games are started within the last hour and have drawn some cards.
+        """
+        player_count = self.random.randint(2, 6)
+        players = self.random.sample(self.users, player_count)
+        seed = generate_seed_for_players(player_count, self.random.random())
+        dnf = not live and self.random.random() < self.dnf_ratio
+
+        if live:
+            start_datetime = timezone.now() - datetime.timedelta(
+                seconds=self.random.uniform(0, 60 * 60)
+            )
+        else:
+            start_datetime = self.random_datetime()
+
+        game = Game(
+            id=self.game_id,
+            player_count=player_count,
+            start_datetime=start_datetime,
+            official=self.random.random() < 0.95,
+            dnf=dnf,
+        )
+        game.set_seed(seed)
+        self.game_id += 1
+
+        if self.random.random() < self.location_ratio:
+            for k, v in self.random_location().items():
+                setattr(game, k, v)
+
+        gameplayers = []
+        for position, user in enumerate(players):
+            gameplayers.append(
+                GamePlayer(
+                    id=self.gameplayer_id,
+                    game_id=game.id,
+                    user_id=user.id,
+                    position=position,
+                    dnf=self.random.random() < 0.02,
+                )
+            )
+            self.gameplayer_id += 1
+
+        deck = Card.get_shuffled_deck(player_count, seed)
+        if live or dnf:
+            deck = deck[: self.random.randrange(len(deck))]
+
+        cards = []
+        chugs = []
+        delta_ms = 0
+        for index, (value, suit) in enumerate(deck):
+            delta_ms += self.random.randint(self.MIN_TURN_MS, self.MAX_TURN_MS)
+            cards.append(
+                Card(
+                    id=self.card_id,
+                    game_id=game.id,
+                    gameplayer_id=gameplayers[index % player_count].id,
+                    index=index,
+                    value=value,
+                    suit=suit,
+                    start_delta_ms=delta_ms,
+                )
+            )
+
+            if value == Chug.VALUE:
+                duration_ms = self.random.randint(self.MIN_CHUG_MS, self.MAX_CHUG_MS)
+                chugs.append(
+                    Chug(
+                        id=self.chug_id,
+                        card_id=self.card_id,
+                        start_start_delta_ms=delta_ms,
+                        duration_ms=duration_ms,
+                    )
+                )
+                self.chug_id += 1
+                delta_ms += duration_ms
+
+            self.card_id += 1
+
+        if not live and not dnf:
+            game.end_datetime = game.start_datetime + datetime.timedelta(
+                milliseconds=delta_ms
+            )
+
+            if self.random.random() < self.description_ratio:
+                game.description = self.random_description()
+
+        # As bulk_create doesn't call save, which sets the season.
+        # Uses the annotations of Game.add_last_card_start_delta_ms,
+        # as the cards haven't been saved yet.
+        game.has_cards = len(cards) > 0
+        game.last_card_start_delta_ms = cards[-1].start_delta_ms if cards else None
+        game.update_season_number()
+
+        return game, gameplayers, cards, chugs
+
+    def get_update_state_data(self, game, gameplayers, cards, chugs):
+        """
+        Returns the data the client would send to update_state for the game.
+        """
+        chugs = {chug.card_id: chug for chug in chugs}
+        cards_data = []
+        for card in cards:
+            card_data = {
+                "value": card.value,
+                "suit": card.suit,
+                "start_delta_ms": card.start_delta_ms,
+            }
+            chug = chugs.get(card.id)
+            if chug:
+                card_data["chug_start_start_delta_ms"] = chug.start_start_delta_ms
+                card_data["chug_end_start_delta_ms"] = (
+                    chug.start_start_delta_ms + chug.duration_ms
+                )
+            cards_data.append(card_data)
+
+        data = {
+            "start_datetime": game.start_datetime.isoformat(),
+            "official": game.official,
+            "seed": game.get_seed(),
+            "cards": cards_data,
+            "player_ids": [gp.user_id for gp in gameplayers],
+            "player_names": [self.usernames[gp.user_id] for gp in gameplayers],
+            "has_ended": game.has_ended,
+            "dnf": game.dnf,
+            "dnf_player_ids": [gp.user_id for gp in gameplayers if gp.dnf],
+        }
+
+        if game.description:
+            data["description"] = game.description
+
+        if game.location_latitude is not None:
+            data["location"] = {
+                "latitude": game.location_latitude,
+                "longitude": game.location_longitude,
+                "accuracy": game.location_accuracy,
+            }
+
+        return data
+
+    def create_games(
+        self, count, chunk_size=1000, progress=None, live=False, callback=None
+    ):
+        """
+        Creates count games. If given, callback is called with the
+        game, gameplayers, cards and chugs of every game.
+        """
+        for _, size in chunks(count, chunk_size):
+            games = []
+            gameplayers = []
+            cards = []
+            chugs = []
+            for _ in range(size):
+                game, game_gameplayers, game_cards, game_chugs = self.generate_game(
+                    live
+                )
+                if callback:
+                    callback(game, game_gameplayers, game_cards, game_chugs)
+
+                games.append(game)
+                gameplayers += game_gameplayers
+                cards += game_cards
+                chugs += game_chugs
+
+            Game.objects.bulk_create(games)
+            GamePlayer.objects.bulk_create(gameplayers)
+            Card.objects.bulk_create(cards)
+            Chug.objects.bulk_create(chugs)
+            GameHashtag.objects.bulk_create(
+                hashtag for game in games for hashtag in hashtags_for_game(game)
+            )
+
+            if progress:
+                progress.update(size)
+
+        reset_sequences(Game, GamePlayer, Card, Chug)
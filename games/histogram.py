@@ -0,0 +1,70 @@
+from django.db import connection
+from django.db.models import (
+    BigIntegerField,
+    Count,
+    DurationField,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    Func,
+    IntegerField,
+    Value,
+)
+from django.db.models.functions import Cast, Extract
+
+
+def duration_microseconds(start_key, end_key):
+    """
+    Returns an expression for the number of microseconds between two datetimes.
+    """
+    duration = ExpressionWrapper(F(end_key) - F(start_key), DurationField())
+    if connection.vendor == "postgresql":
+        return Extract(duration, "epoch") * Value(1000 * 1000)
+
+    # Durations are stored as microseconds on backends without an interval type
+    return Cast(duration, BigIntegerField())
+
+
+def bucket_expression(value, first, bucket_span, buckets):
+    if connection.vendor == "postgresql":
+        # width_bucket counts the buckets from 1
+        return (
+            Func(
+                Cast(value, FloatField()),
+                Value(float(first)),
+                Value(float(first + bucket_span * buckets)),
+                Value(buckets),
+                function="width_bucket",
+                output_field=IntegerField(),
+            )
+            - 1
+        )
+
+    # Values are at least first, so casting truncates like int()
+    return Cast((value - Value(first)) / Value(bucket_span), IntegerField())
+
+
+def get_histogram(qs, value, bucket_span, buckets, first=0):
+    """
+    Returns the number of rows of qs in each of the buckets,
+    where a row is in bucket int((value - first) / bucket_span).
+    Rows with a value outside the buckets are ignored.
+
+    The buckets are computed in the database, returning a row per bucket.
+    """
+    counts = dict(
+        qs.annotate(histogram_value=value)
+        .filter(
+            histogram_value__gte=first,
+            histogram_value__lt=first + bucket_span * buckets,
+        )
+        .annotate(
+            bucket=bucket_expression(F("histogram_value"), first, bucket_span, buckets)
+        )
+        .order_by()
+        .values("bucket")
+        .annotate(count=Count("*"))
+        .values_list("bucket", "count")
+    )
+
+    return [counts.get(i, 0) for i in range(buckets)]
@@ -0,0 +1,48 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from .serializers import CardSerializer, GameUpdateSerializer
+
+logger = logging.getLogger(__name__)
+
+
+def get_game_group_name(game_id):
+    return f"game_{game_id}"
+
+
+def get_game_update(game, first_index):
+    """
+    Returns the fields of the game that can change during a game,
+    and the cards from first_index on, replacing the cards the spectators have.
+    The spectators compute the player stats from the cards themselves.
+    """
+    data = GameUpdateSerializer(game).data
+    data["first_index"] = first_index
+    data["cards"] = CardSerializer(
+        game.ordered_cards().filter(index__gte=first_index).select_related("chug"),
+        many=True,
+    ).data
+    return data
+
+
+def publish_game_update(game, first_index):
+    """
+    Sends the update to the spectators of the game, see GameConsumer,
+    once the transaction has been committed.
+    Failing to send it doesn't fail the update of the game,
+    as the spectators fetch the full game when they reconnect.
+    """
+
+    def send():
+        try:
+            async_to_sync(get_channel_layer().group_send)(
+                get_game_group_name(game.id),
+                {"type": "game_update", **get_game_update(game, first_index)},
+            )
+        except Exception:
+            logger.exception("Failed to publish update of game %s", game.id)
+
+    transaction.on_commit(send)
@@ -0,0 +1,133 @@
+import json
+import statistics
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from tqdm import tqdm
+
+from games.benchmark import benchmark_database, measure
+from games.fake_data import FakeGameGenerator, create_fake_users
+from games.models import (
+    Game,
+    PlayerStat,
+    User,
+    all_time_season,
+    recalculate_all_stats,
+)
+from games.ranking import RANKINGS
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the web pages and API routes on a synthetic dataset"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--games", type=int, default=20000)
+        parser.add_argument("--users", type=int, default=2000)
+        parser.add_argument("--random-seed", type=int, default=0)
+        parser.add_argument(
+            "--repeat", type=int, default=5, help="Requests timed per route"
+        )
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument(
+            "--compare", help="Compare with the results in this JSON file"
+        )
+
+    def get_routes(self):
+        game = Game.objects.filter(end_datetime__isnull=False).first()
+        user_id = (
+            PlayerStat.objects.filter(season_number=all_time_season.number)
+            .order_by("-total_games")
+            .values_list("user_id", flat=True)
+            .first()
+        )
+
+        routes = {
+            "index": "/",
+            "game_list": "/games/",
+            "game_list_username": "/games/?query=fake_user_1",
+            "game_list_hashtag": "/games/?query=%23academy",
+            "game_detail": f"/games/{game.id}/",
+            "player_list": "/players/",
+            "player_detail": f"/players/{user_id}/",
+            "stats": "/stats/",
+            "api_users": "/api/users/",
+            "api_user": f"/api/users/{user_id}/",
+            "api_games": "/api/games/",
+            "api_game": f"/api/games/{game.id}/",
+            "api_live_games": "/api/games/live_games/",
+            "api_ranked_cards": "/api/ranked_cards/",
+            "api_stats": f"/api/stats/{user_id}/",
+        }
+        for ranking in RANKINGS:
+            routes[f"ranking_{ranking.key}"] = f"/ranking/?type={ranking.key}"
+
+        return user_id, routes
+
+    def measure_route(self, client, url, repeat):
+        # The first request fills the template and url caches
+        client.get(url)
+
+        wall_seconds = []
+        for _ in range(repeat):
+            with measure() as m:
+                r = client.get(url)
+            wall_seconds.append(m.wall_seconds)
+
+        with measure(trace_memory=True) as memory_m:
+            client.get(url)
+
+        return {
+            "url": url,
+            "status": r.status_code,
+            "queries": m.queries,
+            "wall_seconds": statistics.median(wall_seconds),
+            "min_wall_seconds": min(wall_seconds),
+            "peak_memory_bytes": memory_m.peak_memory_bytes,
+        }
+
+    def print_comparison(self, results, path):
+        with open(path) as f:
+            old_routes = json.load(f)["routes"]
+
+        for name, new in results["routes"].items():
+            old = old_routes.get(name)
+            if not old:
+                continue
+
+            print(
+                f"{name:36} queries {old['queries']:>6} -> {new['queries']:<6} "
+                f"wall {old['wall_seconds'] * 1000:>9.1f} -> {new['wall_seconds'] * 1000:.1f} ms"
+            )
+
+    def handle(self, *args, **options):
+        results = {
+            "games": options["games"],
+            "users": options["users"],
+            "random_seed": options["random_seed"],
+            "routes": {},
+        }
+
+        with benchmark_database():
+            print("Generating data...")
+            users = create_fake_users(options["users"])
+            generator = FakeGameGenerator(users, options["random_seed"])
+            with tqdm(total=options["games"]) as progress:
+                generator.create_games(options["games"], progress=progress)
+            recalculate_all_stats()
+
+            user_id, routes = self.get_routes()
+            client = Client()
+            client.force_login(User.objects.get(id=user_id))
+
+            for name, url in tqdm(routes.items()):
+                results["routes"][name] = self.measure_route(
+                    client, url, options["repeat"]
+                )
+
+        print(json.dumps(results, indent=4))
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=4)
+
+        if options["compare"]:
+            self.print_comparison(results, options["compare"])
@@ -0,0 +1,83 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from games.benchmark import benchmark_database, measure
+from games.fake_data import FakeGameGenerator, create_fake_users
+from games.models import Card, Game, GamePlayer
+from games.serializers import GameSerializer
+from games.views import update_game
+
+
+class Command(BaseCommand):
+    help = "Benchmarks sending the full state of 6-player games after every card"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--games", type=int, default=20)
+        parser.add_argument("--random-seed", type=int, default=0)
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+
+    def get_game_states(self, generator):
+        """
+        Creates a 6-player game without cards,
+        returning the states sent by the client during the game.
+        """
+        while True:
+            game, gameplayers, cards, chugs = generator.generate_game()
+            if len(gameplayers) == 6:
+                break
+
+        game.id = None
+        game.end_datetime = None
+        game.save()
+        for gp in gameplayers:
+            gp.id = None
+            gp.game = game
+        GamePlayer.objects.bulk_create(gameplayers)
+
+        data = generator.get_update_state_data(game, gameplayers, cards, chugs)
+        data.pop("description", None)
+        states = []
+        for i in range(1, len(data["cards"]) + 1):
+            states.append({**data, "cards": data["cards"][:i], "has_ended": False})
+
+        return game, states
+
+    def run(self, generator, games, cached):
+        validate_seconds = 0
+        with measure() as m:
+            for _ in range(games):
+                game, states = self.get_game_states(generator)
+                for state in states:
+                    if not cached:
+                        Card._get_shuffled_deck.cache_clear()
+
+                    with measure() as validate_m:
+                        s = GameSerializer(game, data=state)
+                        s.is_valid(raise_exception=True)
+                    validate_seconds += validate_m.wall_seconds
+
+                    with transaction.atomic():
+                        game = Game.objects.select_for_update().get(id=game.id)
+                        update_game(game, s.validated_data)
+
+        return {**m.as_dict(), "validate_seconds": validate_seconds}
+
+    def handle(self, *args, **options):
+        results = {"games": options["games"]}
+
+        with benchmark_database():
+            users = create_fake_users(6)
+            generator = FakeGameGenerator(users, options["random_seed"], dnf_ratio=0)
+
+            print("Running without deck cache...")
+            results["uncached"] = self.run(generator, options["games"], False)
+
+            print("Running with deck cache...")
+            results["cached"] = self.run(generator, options["games"], True)
+
+        print(json.dumps(results, indent=4))
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=4)
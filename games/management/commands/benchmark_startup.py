@@ -0,0 +1,125 @@
+import json
+import statistics
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand
+
+# Run in a new interpreter, so nothing is imported beforehand
+STARTUP_SCRIPT = """
+import json
+import resource
+import sys
+import time
+
+start = time.perf_counter()
+
+import django
+
+django.setup()
+setup_end = time.perf_counter()
+
+from django.urls import get_resolver
+
+get_resolver().url_patterns
+urlconf_end = time.perf_counter()
+
+if sys.argv[1] == "asgi":
+    from academy.asgi import application
+else:
+    from academy.celery import app
+
+    app.loader.import_default_modules()
+end = time.perf_counter()
+
+print(
+    json.dumps(
+        {
+            "setup_seconds": setup_end - start,
+            "urlconf_seconds": urlconf_end - setup_end,
+            "entrypoint_seconds": end - urlconf_end,
+            "total_seconds": end - start,
+            # Kilobytes on Linux
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "scipy_imported": "scipy" in sys.modules,
+        }
+    )
+)
+"""
+
+ENTRYPOINTS = ["asgi", "celery"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the startup of the ASGI application and the Celery worker, "
+        "including django.setup() and importing the URLConf"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repeat", type=int, default=5, help="Processes started per entrypoint"
+        )
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument(
+            "--compare", help="Compare with the results in this JSON file"
+        )
+
+    def measure_startup(self, entrypoint):
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT, entrypoint],
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        ).stdout
+        # Only the last line, in case importing printed anything
+        return json.loads(output.strip().splitlines()[-1])
+
+    def measure_entrypoint(self, entrypoint, repeat):
+        runs = [self.measure_startup(entrypoint) for _ in range(repeat)]
+        return {
+            **{
+                key: statistics.median(run[key] for run in runs)
+                for key in [
+                    "setup_seconds",
+                    "urlconf_seconds",
+                    "entrypoint_seconds",
+                    "total_seconds",
+                    "max_rss_bytes",
+                ]
+            },
+            "scipy_imported": any(run["scipy_imported"] for run in runs),
+        }
+
+    def print_comparison(self, results, path):
+        with open(path) as f:
+            old_entrypoints = json.load(f)["entrypoints"]
+
+        for name, new in results["entrypoints"].items():
+            old = old_entrypoints.get(name)
+            if not old:
+                continue
+
+            print(
+                f"{name:10} total {old['total_seconds'] * 1000:>8.1f} -> "
+                f"{new['total_seconds'] * 1000:.1f} ms "
+                f"rss {old['max_rss_bytes'] / 1024 ** 2:>7.1f} -> "
+                f"{new['max_rss_bytes'] / 1024 ** 2:.1f} MB"
+            )
+
+    def handle(self, *args, **options):
+        results = {"repeat": options["repeat"], "entrypoints": {}}
+
+        for entrypoint in ENTRYPOINTS:
+            print(f"Starting {entrypoint}...")
+            results["entrypoints"][entrypoint] = self.measure_entrypoint(
+                entrypoint, options["repeat"]
+            )
+
+        print(json.dumps(results, indent=4))
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=4)
+
+        if options["compare"]:
+            self.print_comparison(results, options["compare"])
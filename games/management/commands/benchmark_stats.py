@@ -0,0 +1,60 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from tqdm import tqdm
+
+from games.benchmark import benchmark_database, measure
+from games.fake_data import FakeGameGenerator, create_fake_users
+from games.models import PlayerStat
+
+
+class Command(BaseCommand):
+    help = "Benchmarks recalculating PlayerStat on a synthetic dataset"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--games", type=int, default=50000)
+        parser.add_argument("--users", type=int, default=2000)
+        parser.add_argument("--random-seed", type=int, default=0)
+        parser.add_argument(
+            "--skip-slow", action="store_true", help="Only run the bulk recalculation",
+        )
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+
+    def stats_rows(self):
+        fields = ["user_id", "season_number"] + [
+            f"{f}_id" if f in ["best_game", "worst_game", "fastest_chug"] else f
+            for f in PlayerStat.stat_fields()
+        ]
+        return set(PlayerStat.objects.values_list(*fields))
+
+    def handle(self, *args, **options):
+        results = {"games": options["games"], "users": options["users"]}
+
+        with benchmark_database():
+            print("Generating data...")
+            users = create_fake_users(options["users"])
+            generator = FakeGameGenerator(users, options["random_seed"])
+            with tqdm(total=options["games"]) as progress:
+                generator.create_games(options["games"], progress=progress)
+
+            print("Running bulk recalculation...")
+            with measure() as m:
+                PlayerStat.recalculate_all(bulk=True)
+            results["bulk"] = m.as_dict()
+            bulk_rows = self.stats_rows()
+
+            if not options["skip_slow"]:
+                PlayerStat.objects.all().delete()
+
+                print("Running slow recalculation...")
+                with measure() as m:
+                    PlayerStat.recalculate_all(bulk=False)
+                results["slow"] = m.as_dict()
+
+                if self.stats_rows() != bulk_rows:
+                    raise CommandError("Bulk and slow recalculation differ")
+
+        print(json.dumps(results, indent=4))
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=4)
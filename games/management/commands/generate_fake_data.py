@@ -0,0 +1,71 @@
+import json
+
+from django.core.management.base import BaseCommand
+from tqdm import tqdm
+
+from games.fake_data import FakeGameGenerator, create_fake_users
+
+
+class Command(BaseCommand):
+    help = "Creates fake users and games for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--games", type=int, default=10000)
+        parser.add_argument(
+            "--live-games", type=int, default=5, help="Additional live games"
+        )
+        parser.add_argument("--random-seed", type=int)
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--dnf-ratio", type=float, default=0.03)
+        parser.add_argument("--location-ratio", type=float, default=0.5)
+        parser.add_argument("--description-ratio", type=float, default=0.3)
+        parser.add_argument(
+            "--payloads",
+            help="Also write the update_state data of every game to this file, "
+            "as JSON lines. When replaying, create the game with the same "
+            "official value and replace start_datetime with the one of the new game",
+        )
+
+    def handle(self, *args, **options):
+        print("Creating users...")
+        users = create_fake_users(options["users"], chunk_size=options["chunk_size"])
+
+        generator = FakeGameGenerator(
+            users,
+            options["random_seed"],
+            dnf_ratio=options["dnf_ratio"],
+            location_ratio=options["location_ratio"],
+            description_ratio=options["description_ratio"],
+        )
+
+        payloads = None
+        callback = None
+        if options["payloads"]:
+            payloads = open(options["payloads"], "w")
+
+            def callback(*game_objects):
+                data = generator.get_update_state_data(*game_objects)
+                payloads.write(json.dumps(data) + "\n")
+
+        try:
+            print("Creating games...")
+            with tqdm(total=options["games"] + options["live_games"]) as progress:
+                generator.create_games(
+                    options["games"],
+                    chunk_size=options["chunk_size"],
+                    progress=progress,
+                    callback=callback,
+                )
+                generator.create_games(
+                    options["live_games"],
+                    chunk_size=options["chunk_size"],
+                    progress=progress,
+                    live=True,
+                    callback=callback,
+                )
+        finally:
+            if payloads:
+                payloads.close()
+
+        print("Run update_stats to calculate the stats of the new games")
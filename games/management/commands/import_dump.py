@@ -195,6 +195,8 @@ class Command(BaseCommand):
                     f"Bad game: {game.id} ({game.cards.count()} instead of {expected_cards} cards)"
                 )
                 game.delete()
+            else:
+                game.assign_card_players()
 
     def fix_times(self):
         print("Fixing times of games/cards")
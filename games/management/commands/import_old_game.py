@@ -173,6 +173,7 @@ class Command(BaseCommand):
                     f"Wrong number of chugs: {chugs_count}, but expected {player_count}"
                 )
 
+            game.assign_card_players()
             update_stats_on_game_finished(game)
 
         print(f"Successfully imported game. Id: {game.id}")
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from games.achievements import evaluate_achievements
+
+
+class Command(BaseCommand):
+    help = "Evaluates the achievements of all users"
+
+    def handle(self, *args, **options):
+        evaluate_achievements()
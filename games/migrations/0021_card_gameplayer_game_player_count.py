@@ -0,0 +1,73 @@
+# Generated by Django 3.0.8 on 2026-10-16 20:58
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def fill_card_players(apps, schema_editor):
+    Game = apps.get_model("games", "Game")
+    GamePlayer = apps.get_model("games", "GamePlayer")
+    Card = apps.get_model("games", "Card")
+
+    gameplayer_ids = defaultdict(list)
+    for game_id, gameplayer_id in (
+        GamePlayer.objects.order_by("game_id", "position")
+        .values_list("game_id", "id")
+        .iterator()
+    ):
+        gameplayer_ids[game_id].append(gameplayer_id)
+
+    game_ids = defaultdict(list)
+    for game_id, ids in gameplayer_ids.items():
+        game_ids[len(ids)].append(game_id)
+
+    for player_count, ids in game_ids.items():
+        for i in range(0, len(ids), BATCH_SIZE):
+            Game.objects.filter(id__in=ids[i : i + BATCH_SIZE]).update(
+                player_count=player_count
+            )
+
+    cards = []
+    for card in Card.objects.only("id", "game_id", "index").iterator():
+        ids = gameplayer_ids.get(card.game_id)
+        if not ids:
+            continue
+
+        card.gameplayer_id = ids[card.index % len(ids)]
+        cards.append(card)
+        if len(cards) == BATCH_SIZE:
+            Card.objects.bulk_update(cards, ["gameplayer"])
+            cards = []
+
+    Card.objects.bulk_update(cards, ["gameplayer"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0020_game_facebook_post_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="player_count",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="card",
+            name="gameplayer",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="cards",
+                to="games.GamePlayer",
+            ),
+        ),
+        migrations.RunPython(fill_card_players, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 3.0.8 on 2026-10-16 21:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0021_card_gameplayer_game_player_count"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RankingEntry",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("season_number", models.PositiveIntegerField()),
+                ("key", models.CharField(max_length=50)),
+                ("rank", models.PositiveIntegerField()),
+                ("value", models.FloatField()),
+                (
+                    "game",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="games.Game",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {
+                    ("season_number", "key", "rank"),
+                    ("season_number", "key", "user"),
+                },
+            },
+        ),
+    ]
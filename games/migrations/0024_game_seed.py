@@ -0,0 +1,18 @@
+# Generated by Django 3.0.8 on 2026-10-16 22:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0023_userachievement"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="seed",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.0.8 on 2026-10-16 23:05
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+HASHTAG_RE = re.compile(r"#([^# ]+)")
+
+
+def get_hashtags(description):
+    # Frozen copy of games.search.get_hashtags
+    return sorted({tag.lower() for tag in HASHTAG_RE.findall(description)})
+
+
+def add_hashtags(apps, schema_editor):
+    Game = apps.get_model("games", "Game")
+    GameHashtag = apps.get_model("games", "GameHashtag")
+
+    hashtags = []
+    for game_id, description in (
+        Game.objects.exclude(description="").values_list("id", "description").iterator()
+    ):
+        hashtags += [
+            GameHashtag(game_id=game_id, tag=tag) for tag in get_hashtags(description)
+        ]
+
+    GameHashtag.objects.bulk_create(hashtags, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0024_game_seed"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GameHashtag",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("tag", models.CharField(db_index=True, max_length=1000)),
+                (
+                    "game",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="hashtags",
+                        to="games.Game",
+                    ),
+                ),
+            ],
+            options={"unique_together": {("game", "tag")},},
+        ),
+        migrations.RunPython(add_hashtags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+import sqlite3
+
+from django.db import migrations
+
+POSTGRESQL_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # Matches the expression used by username__icontains
+    "CREATE INDEX games_user_username_trgm ON games_user "
+    'USING gin ((UPPER("username"::text)) gin_trgm_ops)',
+]
+
+POSTGRESQL_BACKWARD = [
+    "DROP INDEX IF EXISTS games_user_username_trgm",
+]
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE games_user_search USING fts5("
+    "username, content='games_user', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER games_user_search_insert AFTER INSERT ON games_user BEGIN "
+    "INSERT INTO games_user_search(rowid, username) VALUES (new.id, new.username); "
+    "END",
+    "CREATE TRIGGER games_user_search_delete AFTER DELETE ON games_user BEGIN "
+    "INSERT INTO games_user_search(games_user_search, rowid, username) "
+    "VALUES ('delete', old.id, old.username); "
+    "END",
+    "CREATE TRIGGER games_user_search_update AFTER UPDATE OF username ON games_user "
+    "BEGIN "
+    "INSERT INTO games_user_search(games_user_search, rowid, username) "
+    "VALUES ('delete', old.id, old.username); "
+    "INSERT INTO games_user_search(rowid, username) VALUES (new.id, new.username); "
+    "END",
+    "INSERT INTO games_user_search(games_user_search) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS games_user_search_insert",
+    "DROP TRIGGER IF EXISTS games_user_search_delete",
+    "DROP TRIGGER IF EXISTS games_user_search_update",
+    "DROP TABLE IF EXISTS games_user_search",
+]
+
+
+def run_for_vendor(postgresql, sqlite):
+    def run(apps, schema_editor):
+        statements = {"postgresql": postgresql}
+        # The trigram tokenizer needs SQLite 3.34 or later
+        if sqlite3.sqlite_version_info >= (3, 34, 0):
+            statements["sqlite"] = sqlite
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0025_gamehashtag"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor(POSTGRESQL_FORWARD, SQLITE_FORWARD),
+            run_for_vendor(POSTGRESQL_BACKWARD, SQLITE_BACKWARD),
+        ),
+    ]
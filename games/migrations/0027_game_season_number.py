@@ -0,0 +1,67 @@
+# Generated by Django 3.0.8 on 2026-10-16 23:40
+
+import datetime
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def season_number_from_date(date):
+    # Same as Season.season_from_date
+    season_number = (date.year - 2013) * 2 + 1
+    if date.month >= 7:
+        season_number += 1
+    return season_number
+
+
+def set_season_numbers(apps, schema_editor):
+    Game = apps.get_model("games", "Game")
+    Card = apps.get_model("games", "Card")
+
+    game_ids = defaultdict(list)
+
+    for game_id, end_datetime in (
+        Game.objects.filter(end_datetime__isnull=False)
+        .values_list("id", "end_datetime")
+        .iterator()
+    ):
+        game_ids[season_number_from_date(end_datetime)].append(game_id)
+
+    last_cards = Card.objects.filter(game=OuterRef("pk")).order_by("-index")
+    dnf_games = Game.objects.filter(end_datetime__isnull=True, dnf=True).annotate(
+        last_card_start_delta_ms=Subquery(last_cards.values("start_delta_ms")[:1])
+    )
+    for game_id, start_datetime, last_card_start_delta_ms in dnf_games.values_list(
+        "id", "start_datetime", "last_card_start_delta_ms"
+    ).iterator():
+        last_activity_time = start_datetime
+        if last_card_start_delta_ms:
+            last_activity_time += datetime.timedelta(
+                milliseconds=last_card_start_delta_ms
+            )
+        game_ids[season_number_from_date(last_activity_time)].append(game_id)
+
+    for season_number, ids in game_ids.items():
+        for i in range(0, len(ids), 500):
+            Game.objects.filter(id__in=ids[i : i + 500]).update(
+                season_number=season_number
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0026_user_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="season_number",
+            field=models.PositiveIntegerField(
+                blank=True, db_index=True, editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(set_season_numbers, migrations.RunPython.noop),
+    ]
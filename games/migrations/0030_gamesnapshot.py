@@ -0,0 +1,29 @@
+# Generated by Django 3.0.8 on 2026-10-17 02:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0029_playedwithcount"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GameSnapshot",
+            fields=[
+                (
+                    "game",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="games.Game",
+                    ),
+                ),
+                ("data", models.BinaryField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.0.8 on 2026-10-17 05:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0031_game_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GameFinishedStage",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=50)),
+                (
+                    "game",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="games.Game",
+                    ),
+                ),
+            ],
+            options={"unique_together": {("game", "key")},},
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.8 on 2026-10-17 06:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0032_gamefinishedstage"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StatsVersion",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.PositiveIntegerField(default=1)),
+            ],
+        ),
+    ]
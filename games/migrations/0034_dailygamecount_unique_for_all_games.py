@@ -0,0 +1,58 @@
+# Generated by Django 3.0.8 on 2026-10-17 07:05
+
+import datetime
+
+import pytz
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_rows(apps, schema_editor):
+    """
+    Replaces duplicated rows for all games, which were both counted up
+    by every later game that day, with the number of games of that day.
+    """
+    DailyGameCount = apps.get_model("games", "DailyGameCount")
+    Game = apps.get_model("games", "Game")
+
+    duplicates = (
+        DailyGameCount.objects.filter(user=None)
+        .values("date", "player_count")
+        .annotate(rows=Count("id"))
+        .filter(rows__gt=1)
+        .values_list("date", "player_count")
+    )
+    for date, player_count in list(duplicates):
+        # The dates are UTC, see DailyGameCount.get_date
+        start = datetime.datetime.combine(date, datetime.time(), tzinfo=pytz.utc)
+        count = Game.objects.filter(
+            end_datetime__gte=start,
+            end_datetime__lt=start + datetime.timedelta(days=1),
+            player_count=player_count,
+        ).count()
+
+        DailyGameCount.objects.filter(
+            user=None, date=date, player_count=player_count
+        ).delete()
+        DailyGameCount.objects.create(
+            user=None, date=date, player_count=player_count, count=count
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0033_statsversion"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="dailygamecount",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(user=None),
+                fields=("date", "player_count"),
+                name="unique_daily_game_count_for_all_games",
+            ),
+        ),
+    ]
@@ -1,11 +1,27 @@
 import datetime
 import os
 import secrets
+from collections import Counter, defaultdict
+from functools import lru_cache
 
+import numpy as np
 import pytz
 from django.contrib.auth.models import AbstractUser, UserManager
-from django.db import models
-from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Subquery
+from django.db import models, transaction
+from django.db.models import (
+    Count,
+    DurationField,
+    Exists,
+    ExpressionWrapper,
+    F,
+    Max,
+    Min,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+)
+from django.db.models.functions import Coalesce
 from django.templatetags.static import static
 from django.urls import reverse
 from django.utils import timezone
@@ -14,7 +30,9 @@ from PIL import Image
 from tqdm import tqdm
 
 from .facebook import update_game_post
+from .histogram import get_histogram
 from .seed import shuffle_with_seed
+from .utils import zip_groups
 
 
 class CaseInsensitiveUserManager(UserManager):
@@ -59,16 +77,15 @@ def filter_season(qs, season, key=None, should_include_live=False):
     else:
         key = ""
 
-    end_key = key + "end_datetime"
-
-    q = q_between(end_key, season.start_datetime, season.end_datetime)
-    q |= Q(**{f"{key}dnf": True}) & q_between(
-        f"{key}start_datetime", season.start_datetime, season.end_datetime
-    )
+    if season == all_time_season:
+        q = Q(**{f"{key}season_number__isnull": False})
+    else:
+        q = Q(**{f"{key}season_number": season.number})
 
     includes_live = season == all_time_season or Season.current_season() == season
     if includes_live and should_include_live:
-        q |= Q(**{f"{end_key}__isnull": True, f"{key}dnf": False})
+        # Games that haven't ended have no season
+        q |= Q(**{f"{key}season_number__isnull": True})
 
     return qs.filter(q)
 
@@ -82,26 +99,63 @@ def filter_player_count(qs, player_count, key=None):
     else:
         key = ""
 
-    gameplayer_key = key + "gameplayer"
-
-    return qs.annotate(player_count=Count(gameplayer_key)).filter(
-        player_count=player_count
-    )
+    return qs.filter(**{f"{key}player_count": player_count})
 
 
 def filter_season_and_player_count(qs, season, player_count, key=None):
     return filter_player_count(filter_season(qs, season, key), player_count, key)
 
 
+def get_stats_version():
+    """
+    Returns the version of the stats, which changes whenever games finish,
+    used as the version of cached data derived from the stats.
+    """
+    return StatsVersion.objects.get_or_create(id=1)[0].version
+
+
+def bump_stats_version():
+    if not StatsVersion.objects.filter(id=1).update(version=F("version") + 1):
+        StatsVersion.objects.get_or_create(id=1, defaults={"version": 2})
+
+
 def recalculate_all_stats():
+    # games.ranking and games.achievements import this module
+    from .achievements import evaluate_achievements
+    from .ranking import rebuild_leaderboards
+
     PlayerStat.recalculate_all()
     GamePlayerStat.recalculate_all()
+    DailyGameCount.recalculate_all()
+    PlayedWithCount.recalculate_all()
+    rebuild_leaderboards()
+    evaluate_achievements()
+    bump_stats_version()
+
+
+def get_game_finished_stages():
+    """
+    Returns the (key, function) stages updating the stats of a finished game,
+    in the order they must be run, see games.tasks.process_finished_game.
+    """
+    from .achievements import evaluate_achievements_on_game_finished
+    from .ranking import update_leaderboards_on_game_finished
+
+    return [
+        ("player_stats", PlayerStat.update_on_game_finished),
+        ("game_player_stats", GamePlayerStat.update_on_game_finished),
+        ("daily_game_count", DailyGameCount.update_on_game_finished),
+        ("played_with_count", PlayedWithCount.update_on_game_finished),
+        ("leaderboards", update_leaderboards_on_game_finished),
+        ("achievements", evaluate_achievements_on_game_finished),
+        ("stats_version", lambda game: bump_stats_version()),
+        ("facebook_post", update_game_post),
+    ]
 
 
 def update_stats_on_game_finished(game):
-    PlayerStat.update_on_game_finished(game)
-    GamePlayerStat.update_on_game_finished(game)
-    update_game_post(game)
+    for _, stage in get_game_finished_stages():
+        stage(game)
 
 
 class GamePlayerStat(models.Model):
@@ -110,28 +164,77 @@ class GamePlayerStat(models.Model):
     chugs = models.PositiveIntegerField(default=0)
 
     @classmethod
-    def recalculate_all(cls):
+    @transaction.atomic
+    def recalculate_all(cls, chunk_size=1000):
         GamePlayerStat.objects.all().delete()
-        for game in tqdm(Game.objects.all()):
-            cls.update_on_game_finished(game)
+
+        games = Game.objects.filter(end_datetime__isnull=False)
+        game_ids = list(games.order_by("id").values_list("id", flat=True))
+        for i in tqdm(range(0, len(game_ids), chunk_size)):
+            chunk = game_ids[i : i + chunk_size]
+            cls.objects.bulk_create(
+                cls.calculate_for_games(
+                    games.filter(id__gte=chunk[0], id__lte=chunk[-1])
+                )
+            )
 
     @classmethod
     def update_on_game_finished(cls, game):
         if not game.is_completed:
             return
 
-        stats = [
-            GamePlayerStat.objects.get_or_create(gameplayer=gp)[0]
-            for gp in game.ordered_gameplayers()
-        ]
+        stats = cls.calculate_for_games(Game.objects.filter(id=game.id))
+        cls.objects.filter(gameplayer__game=game).delete()
+        cls.objects.bulk_create(stats)
 
-        for round_cards in game.cards_by_round():
-            for i, c in enumerate(round_cards):
-                stats[i].value_sum += c.value
-                stats[i].chugs += c.value == Chug.VALUE
+    @classmethod
+    def calculate_for_games(cls, games):
+        """
+        Returns unsaved stats for every player of the given games.
+
+        The card with index i in a game is drawn by the player
+        at position i % player_count, so the sums are computed for
+        all the games at once with a single bincount over
+        (game offset + position).
+        """
+        gameplayers = list(
+            GamePlayer.objects.filter(game__in=games)
+            .order_by("game_id", "position")
+            .values_list("id", "game_id")
+        )
+        if not gameplayers:
+            return []
+
+        gameplayer_game_ids = np.array([game_id for _, game_id in gameplayers])
+        game_ids, offsets, player_counts = np.unique(
+            gameplayer_game_ids, return_index=True, return_counts=True
+        )
+
+        cards = np.array(
+            Card.objects.filter(game__in=games).values_list(
+                "game_id", "index", "value"
+            ),
+            dtype=np.int64,
+        ).reshape(-1, 3)
+        cards = cards[np.isin(cards[:, 0], game_ids)]
+
+        card_games = np.searchsorted(game_ids, cards[:, 0])
+        card_gameplayers = offsets[card_games] + cards[:, 1] % player_counts[card_games]
+        values = cards[:, 2]
+
+        value_sums = np.bincount(
+            card_gameplayers, weights=values, minlength=len(gameplayers)
+        )
+        chugs = np.bincount(
+            card_gameplayers, weights=values == Chug.VALUE, minlength=len(gameplayers)
+        )
 
-        for s in stats:
-            s.save()
+        return [
+            cls(gameplayer_id=gameplayer_id, value_sum=value_sum, chugs=chug_count)
+            for (gameplayer_id, _), value_sum, chug_count in zip(
+                gameplayers, value_sums.astype(int).tolist(), chugs.astype(int).tolist()
+            )
+        ]
 
     @classmethod
     def get_stats_with_player_count(cls, season, player_count):
@@ -141,14 +244,24 @@ class GamePlayerStat(models.Model):
 
     @classmethod
     def get_distribution(cls, field, season, player_count):
-        sq = Subquery(
-            cls.get_stats_with_player_count(season, player_count).values("id")
-        )
+        """
+        Returns the smallest value of the field,
+        and the number of stats with each value from there on.
+        """
+        stats = cls.get_stats_with_player_count(season, player_count)
+        bounds = stats.aggregate(first=Min(field), last=Max(field))
+        if bounds["first"] is None:
+            return None, []
+
         return (
-            GamePlayerStat.objects.filter(id__in=sq)
-            .values(value=F(field))
-            .annotate(Count("value"))
-            .order_by(field)
+            bounds["first"],
+            get_histogram(
+                stats,
+                F(field),
+                1,
+                bounds["last"] - bounds["first"] + 1,
+                first=bounds["first"],
+            ),
         )
 
     @classmethod
@@ -160,10 +273,247 @@ class GamePlayerStat(models.Model):
         return cls.get_distribution("chugs", season, player_count)
 
 
+class DailyGameCount(models.Model):
+    """
+    The number of completed games per (UTC) end date and player count,
+    for all games when user is null, and otherwise for the games of the user.
+    """
+
+    class Meta:
+        unique_together = [("date", "player_count", "user")]
+        constraints = [
+            # unique_together doesn't cover the rows for all games,
+            # as nulls are distinct
+            models.UniqueConstraint(
+                fields=["date", "player_count"],
+                condition=Q(user=None),
+                name="unique_daily_game_count_for_all_games",
+            ),
+        ]
+
+    date = models.DateField()
+    player_count = models.PositiveSmallIntegerField()
+    user = models.ForeignKey("User", on_delete=models.CASCADE, null=True)
+    count = models.PositiveIntegerField(default=0)
+
+    @staticmethod
+    def get_date(end_datetime):
+        return end_datetime.astimezone(pytz.utc).date()
+
+    @classmethod
+    @transaction.atomic
+    def recalculate_all(cls):
+        cls.objects.all().delete()
+
+        counts = Counter()
+        games = Game.objects.filter(end_datetime__isnull=False)
+        for end_datetime, player_count in games.values_list(
+            "end_datetime", "player_count"
+        ).iterator():
+            counts[cls.get_date(end_datetime), player_count, None] += 1
+
+        for end_datetime, player_count, user_id in (
+            GamePlayer.objects.filter(game__in=games)
+            .values_list("game__end_datetime", "game__player_count", "user_id")
+            .iterator()
+        ):
+            counts[cls.get_date(end_datetime), player_count, user_id] += 1
+
+        cls.objects.bulk_create(
+            (
+                cls(date=date, player_count=player_count, user_id=user_id, count=count)
+                for (date, player_count, user_id), count in counts.items()
+            ),
+            batch_size=1000,
+        )
+
+    @classmethod
+    @transaction.atomic
+    def recalculate_user(cls, user):
+        cls.objects.filter(user=user).delete()
+
+        counts = Counter()
+        for end_datetime, player_count in (
+            GamePlayer.objects.filter(user=user, game__end_datetime__isnull=False)
+            .values_list("game__end_datetime", "game__player_count")
+            .iterator()
+        ):
+            counts[cls.get_date(end_datetime), player_count] += 1
+
+        cls.objects.bulk_create(
+            (
+                cls(date=date, player_count=player_count, user=user, count=count)
+                for (date, player_count), count in counts.items()
+            ),
+            batch_size=1000,
+        )
+
+    @classmethod
+    @transaction.atomic
+    def update_on_game_finished(cls, game):
+        """
+        If another game with the same date and player count finishes
+        concurrently, one of them fails with an IntegrityError
+        and is retried by games.tasks.process_finished_game.
+        """
+        if not game.is_completed:
+            return
+
+        date = cls.get_date(game.end_datetime)
+        user_ids = list(game.gameplayer_set.values_list("user_id", flat=True))
+
+        rows = cls.objects.filter(date=date, player_count=game.player_count).filter(
+            Q(user__isnull=True) | Q(user_id__in=user_ids)
+        )
+        existing_user_ids = set(rows.values_list("user_id", flat=True))
+        rows.update(count=F("count") + 1)
+
+        cls.objects.bulk_create(
+            cls(date=date, player_count=game.player_count, user_id=user_id, count=1)
+            for user_id in [None] + user_ids
+            if user_id not in existing_user_ids
+        )
+
+    @classmethod
+    def get_totals(cls):
+        """
+        Returns the total number of completed games and of players in them.
+        """
+        return cls.objects.filter(user=None).aggregate(
+            total_games=Coalesce(Sum("count"), 0),
+            total_players=Coalesce(
+                Sum(
+                    ExpressionWrapper(
+                        F("count") * F("player_count"), models.IntegerField()
+                    )
+                ),
+                0,
+            ),
+        )
+
+    @classmethod
+    def get_counts(cls, first_date, last_date, user=None, player_count=None):
+        """
+        Returns the number of games per date in the range.
+        """
+        qs = cls.objects.filter(date__gte=first_date, date__lte=last_date, user=user)
+        return dict(
+            filter_player_count(qs, player_count)
+            .values("date")
+            .annotate(total=Sum("count"))
+            .values_list("date", "total")
+        )
+
+
+class PlayedWithCount(models.Model):
+    """
+    The number of ended games per season that user has played with other_user.
+    Every pair of players is stored in both directions.
+    """
+
+    class Meta:
+        unique_together = [("user", "other_user", "season_number")]
+
+    user = models.ForeignKey("User", on_delete=models.CASCADE, related_name="+")
+    other_user = models.ForeignKey("User", on_delete=models.CASCADE, related_name="+")
+    season_number = models.PositiveIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    @staticmethod
+    def get_pairs(user_ids):
+        return [(a, b) for a in user_ids for b in user_ids if a != b]
+
+    @classmethod
+    @transaction.atomic
+    def recalculate_all(cls):
+        cls.objects.all().delete()
+
+        game_user_ids = defaultdict(set)
+        game_season_numbers = {}
+        for game_id, season_number, user_id in (
+            GamePlayer.objects.filter(game__season_number__isnull=False)
+            .values_list("game_id", "game__season_number", "user_id")
+            .iterator()
+        ):
+            game_user_ids[game_id].add(user_id)
+            game_season_numbers[game_id] = season_number
+
+        counts = Counter()
+        for game_id, user_ids in game_user_ids.items():
+            for user_id, other_user_id in cls.get_pairs(user_ids):
+                counts[user_id, other_user_id, game_season_numbers[game_id]] += 1
+
+        cls.objects.bulk_create(
+            (
+                cls(
+                    user_id=user_id,
+                    other_user_id=other_user_id,
+                    season_number=season_number,
+                    count=count,
+                )
+                for (user_id, other_user_id, season_number), count in counts.items()
+            ),
+            batch_size=1000,
+        )
+
+    @classmethod
+    @transaction.atomic
+    def update_on_game_finished(cls, game):
+        if game.season_number is None:
+            return
+
+        user_ids = set(game.gameplayer_set.values_list("user_id", flat=True))
+        pairs = cls.get_pairs(user_ids)
+
+        rows = cls.objects.filter(
+            user_id__in=user_ids,
+            other_user_id__in=user_ids,
+            season_number=game.season_number,
+        )
+        existing_pairs = set(rows.values_list("user_id", "other_user_id"))
+        rows.update(count=F("count") + 1)
+
+        cls.objects.bulk_create(
+            cls(
+                user_id=user_id,
+                other_user_id=other_user_id,
+                season_number=game.season_number,
+                count=1,
+            )
+            for user_id, other_user_id in pairs
+            if (user_id, other_user_id) not in existing_pairs
+        )
+
+    @classmethod
+    def get_counts(cls, user, season, limit=None):
+        """
+        Returns the usernames of the players user has played the most games with,
+        and the number of games, in descending order.
+        """
+        counts = (
+            filter_season(cls.objects.filter(user=user), season)
+            .values("other_user__username")
+            .annotate(total=Sum("count"))
+            .order_by("-total", "other_user__username")
+            .values_list("other_user__username", "total")
+        )
+        return list(counts[:limit] if limit else counts)
+
+    @classmethod
+    def get_count(cls, user, other_user, season):
+        """
+        Returns the number of games the two players have played together.
+        """
+        qs = filter_season(cls.objects.filter(user=user, other_user=other_user), season)
+        return qs.aggregate(total=Coalesce(Sum("count"), 0))["total"]
+
+
 class PlayerStat(models.Model):
     class Meta:
         unique_together = [("user", "season_number")]
 
+    HOURS_PER_ECTS = 28
+
     user = models.ForeignKey("User", on_delete=models.CASCADE)
     season_number = models.PositiveIntegerField()
 
@@ -191,16 +541,29 @@ class PlayerStat(models.Model):
 
     @classmethod
     def update_on_game_finished(cls, game):
+        if not game.official or game.dnf:
+            return
+
         season = game.get_season()
-        for s in [season, all_time_season]:
-            for player in game.players.all():
+        duration = game.get_duration()
+        player_cards = game.get_player_cards()
+        for gp in game.gameplayer_set.all():
+            if gp.dnf:
+                continue
+
+            for s in [season, all_time_season]:
                 ps, _ = PlayerStat.objects.get_or_create(
-                    user=player, season_number=s.number
+                    user_id=gp.user_id, season_number=s.number
                 )
-                ps.update_from_new_game(game)
+                ps.add_game(game.id, duration, player_cards[gp.id])
+                ps.save()
 
     @classmethod
-    def recalculate_all(cls):
+    def recalculate_all(cls, bulk=True):
+        if bulk:
+            cls.bulk_recalculate()
+            return
+
         for season_number in tqdm(range(Season.current_season().number + 1)):
             cls.recalculate_season(Season(season_number))
 
@@ -214,27 +577,134 @@ class PlayerStat(models.Model):
 
     @classmethod
     def recalculate_user(cls, user):
-        for season_number in tqdm(range(Season.current_season().number + 1)):
-            ps, _ = PlayerStat.objects.get_or_create(
-                user=user, season_number=season_number
+        cls.bulk_recalculate(users=[user])
+
+    @classmethod
+    def stat_fields(cls):
+        return [
+            f.name
+            for f in cls._meta.fields
+            if f.default != models.fields.NOT_PROVIDED or f.null
+        ]
+
+    @classmethod
+    @transaction.atomic
+    def bulk_recalculate(cls, users=None):
+        """
+        Recalculates the stats of every season for the given users
+        (or all users), producing the same rows as calling recalculate()
+        on each of them, but using a constant number of queries.
+
+        Games, players and cards are streamed in the order the games ended,
+        so the stats are built exactly as if the games finished one by one.
+        """
+        season_numbers = range(Season.current_season().number + 1)
+
+        games = filter_season(Game.objects, all_time_season).filter(
+            official=True, dnf=False
+        )
+        if users is None:
+            users = User.objects.all()
+        else:
+            games = games.filter(
+                id__in=Subquery(
+                    GamePlayer.objects.filter(user__in=users).values("game_id")
+                )
             )
-            ps.recalculate()
+        user_ids = [u.id for u in users]
 
-    def recalculate(self):
+        existing_stats = {
+            (ps.user_id, ps.season_number): ps
+            for ps in cls.objects.filter(
+                user_id__in=user_ids, season_number__in=season_numbers
+            )
+        }
+
+        stats = {}
+        for user_id in user_ids:
+            for season_number in season_numbers:
+                key = (user_id, season_number)
+                ps = existing_stats.get(key)
+                if not ps:
+                    ps = PlayerStat(user_id=user_id, season_number=season_number)
+                ps.reset()
+                stats[key] = ps
+
+        game_ordering = ("end_datetime", "id")
+        game_rows = games.order_by(*game_ordering).values_list(
+            "id", "start_datetime", "end_datetime", "season_number"
+        )
+        gameplayer_rows = (
+            GamePlayer.objects.filter(game__in=games)
+            .order_by(*(f"game__{f}" for f in game_ordering), "position")
+            .values_list("game_id", "id", "user_id", "dnf")
+        )
+        card_rows = (
+            Card.objects.filter(game__in=games)
+            .order_by(*(f"game__{f}" for f in game_ordering), "index")
+            .values_list(
+                "game_id", "gameplayer_id", "value", "chug__id", "chug__duration_ms"
+            )
+        )
+
+        for (
+            (game_id, start_datetime, end_datetime, season_number),
+            (gameplayers, cards),
+        ) in zip_groups(
+            game_rows.iterator(), gameplayer_rows.iterator(), card_rows.iterator()
+        ):
+            if start_datetime and end_datetime:
+                duration = end_datetime - start_datetime
+            else:
+                duration = None
+
+            player_cards = defaultdict(list)
+            for _, gameplayer_id, value, chug_id, chug_duration_ms in cards:
+                if chug_id:
+                    chug = Chug(id=chug_id, duration_ms=chug_duration_ms)
+                else:
+                    chug = None
+                player_cards[gameplayer_id].append((value, chug))
+
+            for _, gameplayer_id, user_id, dnf in gameplayers:
+                if dnf:
+                    continue
+
+                for s in [season_number, all_time_season.number]:
+                    ps = stats.get((user_id, s))
+                    if ps:
+                        ps.add_game(game_id, duration, player_cards[gameplayer_id])
+
+        fields = cls.stat_fields()
+        cls.objects.bulk_update(
+            [ps for ps in stats.values() if ps.pk], fields, batch_size=1000
+        )
+        cls.objects.bulk_create(
+            [ps for ps in stats.values() if not ps.pk], batch_size=1000
+        )
+
+    def reset(self):
         for f in self._meta.fields:
             if f.default != models.fields.NOT_PROVIDED:
                 setattr(self, f.name, f.default)
             elif f.null:
                 setattr(self, f.name, None)
 
-        gameplayers = filter_season(
-            self.user.gameplayer_set, self.season, key="game"
-        ).filter(game__official=True, game__dnf=False)
+    def recalculate(self):
+        self.reset()
+
+        gameplayers = (
+            filter_season(self.user.gameplayer_set, self.season, key="game")
+            .filter(game__official=True, game__dnf=False)
+            .order_by("game__end_datetime", "game_id")
+        )
 
         for gp in gameplayers:
-            self.update_from_new_game(gp.game)
+            self.update_from_new_game(gp.game, save=False)
+
+        self.save()
 
-    def update_from_new_game(self, game):
+    def update_from_new_game(self, game, save=True):
         if not game.official or game.dnf:
             return
 
@@ -242,10 +712,22 @@ class PlayerStat(models.Model):
         if gp.dnf:
             return
 
+        cards = [
+            (c.value, getattr(c, "chug", None))
+            for c in gp.cards.order_by("index").select_related("chug")
+        ]
+        self.add_game(game.id, game.get_duration(), cards)
+
+        if save:
+            self.save()
+
+    def add_game(self, game_id, duration, cards):
+        """
+        Adds a finished game to the stats,
+        where cards are the (value, chug) pairs drawn by the player.
+        """
         self.total_games += 1
 
-        player_index = gp.position
-        duration = game.get_duration()
         if duration:
             self.total_time_played_seconds += duration.total_seconds()
 
@@ -254,35 +736,29 @@ class PlayerStat(models.Model):
         else:
             total_chug_time = 0
         game_sips = 0
-        for i, c in enumerate(game.ordered_cards()):
-            if i % game.players.count() == player_index:
-                game_sips += c.value
-                if hasattr(c, "chug"):
-                    self.total_chugs += 1
-                    chug_time = c.chug.duration
-                    if chug_time:
-                        total_chug_time += chug_time.total_seconds()
-                        if (
-                            not self.fastest_chug
-                            or chug_time < self.fastest_chug.duration
-                        ):
-                            self.fastest_chug = c.chug
+        for value, chug in cards:
+            game_sips += value
+            if chug:
+                self.total_chugs += 1
+                chug_time = chug.duration
+                if chug_time:
+                    total_chug_time += chug_time.total_seconds()
+                    if not self.fastest_chug or chug_time < self.fastest_chug.duration:
+                        self.fastest_chug = chug
 
         self.total_sips += game_sips
 
-        if not self.best_game or game_sips > self.best_game_sips:
-            self.best_game = game
+        if self.best_game_id is None or game_sips > self.best_game_sips:
+            self.best_game_id = game_id
             self.best_game_sips = game_sips
 
-        if not self.worst_game or game_sips < self.worst_game_sips:
-            self.worst_game = game
+        if self.worst_game_id is None or game_sips < self.worst_game_sips:
+            self.worst_game_id = game_id
             self.worst_game_sips = game_sips
 
         if self.total_chugs > 0:
             self.average_chug_time_seconds = total_chug_time / self.total_chugs
 
-        self.save()
-
     @property
     def season(self):
         if self.season_number == 0:
@@ -299,9 +775,8 @@ class PlayerStat(models.Model):
 
     @property
     def approx_ects(self):
-        HOURS_PER_ECTS = 28
         hours_played = self.total_time_played_seconds / (60 * 60)
-        return hours_played / HOURS_PER_ECTS
+        return hours_played / self.HOURS_PER_ECTS
 
     @property
     def approx_money_spent_tk(self):
@@ -328,6 +803,39 @@ class PlayerStat(models.Model):
         return datetime.timedelta(seconds=self.average_chug_time_seconds)
 
 
+class RankingEntry(models.Model):
+    """
+    A user's position in one of the rankings in games.ranking for a season.
+    """
+
+    class Meta:
+        unique_together = [
+            ("season_number", "key", "rank"),
+            ("season_number", "key", "user"),
+        ]
+
+    season_number = models.PositiveIntegerField()
+    key = models.CharField(max_length=50)
+    rank = models.PositiveIntegerField()
+    user = models.ForeignKey("User", on_delete=models.CASCADE, related_name="+")
+    value = models.FloatField()
+    game = models.ForeignKey(
+        "Game", on_delete=models.CASCADE, null=True, related_name="+"
+    )
+
+
+class UserAchievement(models.Model):
+    """
+    An achievement in games.achievements, that a user has.
+    """
+
+    class Meta:
+        unique_together = [("user", "key")]
+
+    user = models.ForeignKey("User", on_delete=models.CASCADE)
+    key = models.CharField(max_length=50)
+
+
 class User(AbstractUser):
     IMAGE_SIZE = (156, 262)
 
@@ -341,11 +849,21 @@ class User(AbstractUser):
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # None if the username is deferred
+        self._saved_username = self.__dict__.get("username")
+
     def save(self, *args, **kwargs):
         super().save()
 
         save_force_image_name(self, "image", get_user_image_name)
 
+        if self.username != self._saved_username:
+            # The game data includes the usernames of the players
+            GameSnapshot.invalidate(self.games.all())
+            self._saved_username = self.username
+
         if self.image:
             try:
                 image = Image.open(self.image.path)
@@ -376,9 +894,18 @@ class User(AbstractUser):
         return reverse("player_detail", args=[self.id])
 
     def merge_with(self, other_user):
+        from .achievements import evaluate_achievements
+        from .ranking import rebuild_leaderboards
+
         other_user.gameplayer_set.update(user_id=self)
         other_user.delete()
+        GameSnapshot.invalidate(self.games.all())
         PlayerStat.recalculate_user(self)
+        DailyGameCount.recalculate_user(self)
+        PlayedWithCount.recalculate_all()
+        rebuild_leaderboards()
+        evaluate_achievements([self])
+        bump_stats_version()
 
 
 class OneTimePassword(models.Model):
@@ -491,6 +1018,7 @@ class Game(models.Model):
     """
 
     players = models.ManyToManyField(User, through="GamePlayer", related_name="games")
+    player_count = models.PositiveSmallIntegerField(default=0)
     start_datetime = models.DateTimeField(blank=True, null=True, default=timezone.now)
     end_datetime = models.DateTimeField(blank=True, null=True)
     sips_per_beer = models.PositiveSmallIntegerField(default=STANDARD_SIPS_PER_BEER)
@@ -502,11 +1030,44 @@ class Game(models.Model):
     location_accuracy = models.FloatField(null=True, blank=True)
     image = models.ImageField(upload_to=get_game_image_name, blank=True, null=True)
     facebook_post_id = models.CharField(max_length=64, null=True, blank=True)
+    # Comma separated, see get_seed
+    seed = models.CharField(max_length=255, blank=True)
+    # Set on save, when the game has ended, see compute_season
+    season_number = models.PositiveIntegerField(
+        null=True, blank=True, editable=False, db_index=True
+    )
+    # Incremented whenever the game data changes, used as its ETag
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if "description" in field_names:
+            instance._saved_description = instance.description
+        return instance
 
     def save(self, *args, **kwargs):
+        # games.search imports this module
+        from .search import update_game_hashtags
+
+        self.update_season_number()
+        self.version += 1
         super().save()
         save_force_image_name(self, "image", get_game_image_name)
 
+        if self.description != getattr(self, "_saved_description", ""):
+            update_game_hashtags(self)
+            self._saved_description = self.description
+
+    def get_seed(self):
+        if not self.seed:
+            return None
+
+        return [int(v) for v in self.seed.split(",")]
+
+    def set_seed(self, seed):
+        self.seed = ",".join(map(str, seed))
+
     @staticmethod
     def add_durations(qs):
         return qs.annotate(
@@ -515,6 +1076,40 @@ class Game(models.Model):
             )
         )
 
+    @staticmethod
+    def prefetch_cards(qs):
+        return qs.prefetch_related(
+            models.Prefetch("cards", queryset=Card.objects.select_related("chug"))
+        )
+
+    @staticmethod
+    def prefetch_gameplayers(qs):
+        return qs.prefetch_related(
+            models.Prefetch(
+                "gameplayer_set",
+                queryset=GamePlayer.objects.select_related("user").order_by("position"),
+            )
+        )
+
+    @staticmethod
+    def add_last_card_start_delta_ms(qs):
+        """
+        Annotates the start_delta_ms of the last card,
+        used by get_last_activity_time instead of querying the cards.
+        """
+        last_cards = Card.objects.filter(game=OuterRef("pk")).order_by("-index")
+        return qs.annotate(
+            has_cards=Exists(last_cards),
+            last_card_start_delta_ms=Subquery(last_cards.values("start_delta_ms")[:1]),
+        )
+
+    @classmethod
+    def prefetch_list_data(cls, qs):
+        """
+        Adds the data needed to show games in a list without further queries.
+        """
+        return cls.add_last_card_start_delta_ms(cls.prefetch_gameplayers(qs))
+
     def __str__(self):
         return f"{self.datetime}: {self.players_str()}"
 
@@ -542,27 +1137,56 @@ class Game(models.Model):
         if self.end_datetime:
             return self.end_datetime
 
+        if hasattr(self, "last_card_start_delta_ms"):
+            if not self.has_cards:
+                return self.start_datetime
+
+            if self.start_datetime and self.last_card_start_delta_ms:
+                return self.start_datetime + datetime.timedelta(
+                    milliseconds=self.last_card_start_delta_ms
+                )
+
+            return None
+
         cards = self.ordered_cards()
         if len(cards) > 0:
             return cards.last().drawn_datetime
 
         return self.start_datetime
 
-    def get_season(self):
+    def compute_season(self):
+        """
+        Returns the season of the last activity of the ended game,
+        which for DNF games is the time of their last card, not their start.
+        """
         if not self.has_ended:
             return None
 
-        return Season.season_from_date(self.get_last_activity_time())
+        last_activity_time = self.get_last_activity_time() or self.start_datetime
+        return Season.season_from_date(last_activity_time)
+
+    def update_season_number(self):
+        season = self.compute_season()
+        self.season_number = season.number if season else None
+
+    def get_season(self):
+        if self.season_number is None:
+            return None
+
+        return Season(self.season_number)
 
     def season_number_str(self):
-        season = self.get_season()
-        if not season:
+        if self.season_number is None:
             return "-"
-        return str(season.number)
+        return str(self.season_number)
 
     def get_duration(self):
         if self.dnf:
-            return self.get_last_activity_time() - self.start_datetime
+            last_activity_time = self.get_last_activity_time()
+            if not (self.start_datetime and last_activity_time):
+                return None
+
+            return last_activity_time - self.start_datetime
 
         if not (self.start_datetime and self.end_datetime):
             return None
@@ -575,6 +1199,9 @@ class Game(models.Model):
 
         duration = self.get_duration()
         if duration == None:
+            if self.dnf:
+                return "?"
+
             duration = timezone.now() - self.start_datetime
 
         return datetime.timedelta(seconds=round(duration.total_seconds()))
@@ -589,8 +1216,18 @@ class Game(models.Model):
         return timezone.localtime(self.end_datetime).strftime("%B %d, %Y %H:%M")
 
     def ordered_gameplayers(self):
+        if "gameplayer_set" in getattr(self, "_prefetched_objects_cache", {}):
+            return self.gameplayer_set.all()
+
         return self.gameplayer_set.order_by("position")
 
+    def ordered_gameplayers_with_users(self):
+        # prefetch_gameplayers also selects the users
+        if "gameplayer_set" in getattr(self, "_prefetched_objects_cache", {}):
+            return list(self.gameplayer_set.all())
+
+        return list(self.gameplayer_set.select_related("user").order_by("position"))
+
     def ordered_players(self):
         return [p.user for p in self.ordered_gameplayers()]
 
@@ -616,12 +1253,46 @@ class Game(models.Model):
     def ordered_chugs(self):
         return (c.chug for c in self.cards.filter(chug__isnull=False))
 
+    def assign_card_players(self):
+        """
+        Stores the player count and the player drawing each card,
+        for games where the players and cards were created directly.
+        """
+        gameplayers = list(self.ordered_gameplayers())
+        self.player_count = len(gameplayers)
+        self.save()
+
+        cards = list(self.ordered_cards())
+        for c in cards:
+            c.gameplayer = gameplayers[c.index % self.player_count]
+
+        Card.objects.bulk_update(cards, ["gameplayer"])
+
+    def ordered_cards_with_chugs(self):
+        if "cards" in getattr(self, "_prefetched_objects_cache", {}):
+            return list(self.cards.all())
+
+        return list(self.ordered_cards().select_related("chug"))
+
+    def get_player_cards(self):
+        """
+        Returns the (value, chug) pairs drawn by each gameplayer id.
+        """
+        player_cards = defaultdict(list)
+        for c in self.ordered_cards_with_chugs():
+            player_cards[c.gameplayer_id].append((c.value, getattr(c, "chug", None)))
+
+        return player_cards
+
     def get_total_card_count(self):
-        return self.players.count() * len(Card.VALUES)
+        return self.player_count * len(Card.VALUES)
+
+    def get_turn_durations(self, cards=None):
+        if cards is None:
+            cards = self.ordered_cards_with_chugs()
 
-    def get_turn_durations(self):
         prev_finish_start_delta_ms = 0
-        for c in self.ordered_cards():
+        for c in cards:
             if c.finish_start_delta_ms is None:
                 return
 
@@ -638,27 +1309,31 @@ class Game(models.Model):
                 return None
             return a / b
 
-        n = self.players.count()
+        n = self.player_count
+        if n == 0:
+            return
+
+        cards = self.ordered_cards_with_chugs()
         total_sips = [0] * n
         total_drawn = [0] * n
         last_sip = None
-        for i, c in enumerate(self.ordered_cards()):
+        for i, c in enumerate(cards):
             total_sips[i % n] += c.value
             total_drawn[i % n] += 1
             last_sip = (i % n, c.value)
 
-        first_card = self.ordered_cards().first()
+        first_card = cards[0] if cards else None
         if first_card and first_card.start_delta_ms:
             total_times = [0] * n
             total_done = [0] * n
-            for i, dt in enumerate(self.get_turn_durations()):
+            for i, dt in enumerate(self.get_turn_durations(cards)):
                 total_times[i % n] += dt
                 total_done[i % n] += 1
         else:
             total_times = [None] * n
             total_done = [None] * n
 
-        ordered_gameplayers = self.ordered_gameplayers()
+        ordered_gameplayers = self.ordered_gameplayers_with_users()
         for i in range(n):
             full_beers = total_sips[i] // self.sips_per_beer
             extra_sips = total_sips[i] % self.sips_per_beer
@@ -691,6 +1366,59 @@ class Game(models.Model):
         return reverse("game_detail", args=[self.id])
 
 
+class GameHashtag(models.Model):
+    """
+    A lowercased hashtag in the description of a game, see games.search.
+    """
+
+    class Meta:
+        unique_together = [("game", "tag")]
+
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name="hashtags")
+    tag = models.CharField(max_length=1000, db_index=True)
+
+
+class GameFinishedStage(models.Model):
+    """
+    A stage of games.tasks.process_finished_game that has been run for the game,
+    so it isn't run again when the task is retried or scheduled twice.
+    """
+
+    class Meta:
+        unique_together = [("game", "key")]
+
+    game = models.ForeignKey("Game", on_delete=models.CASCADE)
+    key = models.CharField(max_length=50)
+
+
+class StatsVersion(models.Model):
+    """
+    The single row holding the version of the stats, see get_stats_version.
+    Kept in the database, as it is shared by the web and Celery processes.
+    """
+
+    version = models.PositiveIntegerField(default=1)
+
+
+class GameSnapshot(models.Model):
+    """
+    The gzipped JSON of GameSerializerWithPlayerStats for an ended game,
+    see games.snapshots. Deleted whenever the game data is changed.
+    """
+
+    game = models.OneToOneField("Game", on_delete=models.CASCADE, primary_key=True)
+    data = models.BinaryField()
+
+    @classmethod
+    def invalidate(cls, games):
+        """
+        Deletes the snapshots of the games, and bumps their versions.
+        """
+        game_ids = [game.id for game in games]
+        cls.objects.filter(game_id__in=game_ids).delete()
+        Game.objects.filter(id__in=game_ids).update(version=F("version") + 1)
+
+
 class GameToken(models.Model):
     key = models.CharField(max_length=40, unique=True)
     game = models.OneToOneField(Game, on_delete=models.CASCADE)
@@ -740,6 +1468,13 @@ class Card(models.Model):
     FACE_CARD_VALUES = [13, 12, 11]
 
     game = models.ForeignKey("Game", on_delete=models.CASCADE, related_name="cards")
+    gameplayer = models.ForeignKey(
+        "GamePlayer",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="cards",
+    )
     index = models.PositiveSmallIntegerField()
     value = models.SmallIntegerField(choices=VALUES)
     suit = models.CharField(max_length=1, choices=SUITS)
@@ -753,9 +1488,18 @@ class Card(models.Model):
 
     @classmethod
     def get_shuffled_deck(cls, player_count, seed):
+        """
+        Returns the cards in the order given by the seed, as a tuple,
+        as the result is cached for the ongoing games.
+        """
+        return cls._get_shuffled_deck(player_count, tuple(seed))
+
+    @classmethod
+    @lru_cache(maxsize=256)
+    def _get_shuffled_deck(cls, player_count, seed):
         cards = list(cls.get_ordered_cards_for_players(player_count))
         shuffle_with_seed(cards, seed)
-        return cards
+        return tuple(cards)
 
     @property
     def drawn_datetime(self):
@@ -786,7 +1530,7 @@ class Card(models.Model):
         return f"{self.value} {self.suit}"
 
     def get_user(self):
-        return self.game.ordered_players()[self.index % self.game.players.count()]
+        return self.gameplayer.user
 
     def value_str(self):
         return dict(self.VALUES)[self.value]
@@ -1,4 +1,7 @@
-from .models import PlayerStat
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import PlayerStat, RankingEntry, Season, all_time_season
 from .utils import (
     add_thousand_seperators,
     format_chug_duration,
@@ -7,13 +10,6 @@ from .utils import (
 )
 
 
-def django_getattr(obj, key):
-    keys = key.split("__")
-    for k in keys:
-        obj = getattr(obj, k)
-    return obj
-
-
 class Ranking:
     def __init__(
         self, name, ordering, game_key=None, formatter=add_thousand_seperators
@@ -31,31 +27,88 @@ class Ranking:
     def value_key(self):
         return self.ordering.lstrip("-")
 
-    def get_value(self, o):
-        return self.formatter(django_getattr(o, self.value_key))
-
-    def get_game(self, o):
-        if self.game_key:
-            return django_getattr(o, self.game_key)
-        return None
+    def format_value(self, value):
+        # RankingEntry stores every value as a float
+        if value.is_integer():
+            value = int(value)
+        return self.formatter(value)
 
     def get_qs(self, season):
+        # Ties are broken by id, so ranks are well-defined
         return PlayerStat.objects.filter(
             **{
                 "season_number": season.number,
                 "total_games__gt": 0,
                 f"{self.value_key}__isnull": False,
             }
-        ).order_by(self.ordering)
+        ).order_by(self.ordering, "id")
+
+    def ordered_before_q(self, value, stats_id):
+        lookup = "gt" if self.ordering.startswith("-") else "lt"
+        return Q(**{f"{self.value_key}__{lookup}": value}) | Q(
+            **{self.value_key: value, "id__lt": stats_id}
+        )
 
     def get_rank(self, user, season):
-        stats = user.stats_for_season(season)
+        return get_ranks(user, season, [self])[self.key]
+
+    def get_entries(self, season):
+        return RankingEntry.objects.filter(
+            season_number=season.number, key=self.key
+        ).order_by("rank")
+
+    def calculate_entries(self, season, start=0, stop=None):
+        fields = ["user_id", self.value_key]
+        if self.game_key:
+            fields.append(self.game_key)
+
+        rows = self.get_qs(season).values_list(*fields)[start:stop]
+        for rank, (user_id, value, *game_id) in enumerate(rows, start + 1):
+            yield RankingEntry(
+                season_number=season.number,
+                key=self.key,
+                rank=rank,
+                user_id=user_id,
+                value=value,
+                game_id=game_id[0] if game_id else None,
+            )
+
+    @transaction.atomic
+    def rebuild_entries(self, season):
+        self.get_entries(season).delete()
+        RankingEntry.objects.bulk_create(
+            self.calculate_entries(season), batch_size=1000
+        )
+
+    @transaction.atomic
+    def update_entries(self, season, new_ranks):
+        """
+        Updates the entries after a game has been added to the stats of users,
+        given their new ranks as a dict from user id to rank.
+
+        Adding a game can only move a user up in every ranking,
+        so only the entries between the new and old ranks of the users change.
+        """
+        if not new_ranks:
+            return
+
+        old_ranks = dict(
+            self.get_entries(season)
+            .filter(user_id__in=new_ranks)
+            .values_list("user_id", "rank")
+        )
+
+        start = min(new_ranks.values()) - 1
+        stop = None
+        if len(old_ranks) == len(new_ranks):
+            stop = max(old_ranks.values())
 
-        try:
-            user_index = list(self.get_qs(season)).index(stats)
-            return user_index + 1
-        except ValueError:
-            return None
+        entries = self.get_entries(season).filter(rank__gt=start)
+        if stop is not None:
+            entries = entries.filter(rank__lte=stop)
+        entries.delete()
+
+        RankingEntry.objects.bulk_create(self.calculate_entries(season, start, stop))
 
 
 RANKINGS = [
@@ -75,6 +128,82 @@ RANKINGS = [
 ]
 
 
+def get_ranks(user, season, rankings=RANKINGS):
+    """
+    Returns the rank of the user in each of the rankings (None if unranked),
+    as stored in the leaderboards.
+    """
+    ranks = dict(
+        RankingEntry.objects.filter(
+            season_number=season.number,
+            user=user,
+            key__in=[ranking.key for ranking in rankings],
+        ).values_list("key", "rank")
+    )
+    return {ranking.key: ranks.get(ranking.key) for ranking in rankings}
+
+
+def count_ranks(user, season, rankings=RANKINGS):
+    """
+    Returns the rank of the user in each of the rankings (None if unranked),
+    by counting the stats ordered before the user's in a single query.
+    """
+    ranks = {ranking.key: None for ranking in rankings}
+
+    qs = PlayerStat.objects.filter(season_number=season.number, total_games__gt=0)
+    values = (
+        qs.filter(user=user)
+        .values("id", *(ranking.value_key for ranking in rankings))
+        .first()
+    )
+    if not values:
+        return ranks
+
+    counts = {}
+    for ranking in rankings:
+        value = values[ranking.value_key]
+        if value is not None:
+            counts[f"{ranking.key}_rank"] = Count(
+                "id", filter=ranking.ordered_before_q(value, values["id"])
+            )
+
+    if counts:
+        counts = qs.aggregate(**counts)
+
+    for ranking in rankings:
+        count = counts.get(f"{ranking.key}_rank")
+        if count is not None:
+            ranks[ranking.key] = count + 1
+
+    return ranks
+
+
+def rebuild_leaderboards():
+    for season_number in range(Season.current_season().number + 1):
+        for ranking in RANKINGS:
+            ranking.rebuild_entries(Season(season_number))
+
+
+@transaction.atomic
+def update_leaderboards_on_game_finished(game):
+    # Same condition as PlayerStat.update_on_game_finished
+    if not game.official or game.dnf:
+        return
+
+    users = [gp.user for gp in game.gameplayer_set.select_related("user") if not gp.dnf]
+    for season in [game.get_season(), all_time_season]:
+        user_ranks = [(user, count_ranks(user, season)) for user in users]
+        for ranking in RANKINGS:
+            ranking.update_entries(
+                season,
+                {
+                    user.id: ranks[ranking.key]
+                    for user, ranks in user_ranks
+                    if ranks[ranking.key] is not None
+                },
+            )
+
+
 def get_ranking_from_key(key):
     for ranking in RANKINGS:
         if key == ranking.key:
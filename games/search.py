@@ -0,0 +1,177 @@
+import re
+import sqlite3
+
+from django.db import connection, connections
+from django.db.models import Subquery
+from django.db.models.expressions import RawSQL
+
+from .models import GameHashtag, GamePlayer, User
+
+HASHTAG_RE = re.compile(r"#([^# ]+)")
+
+# Index on the usernames, kept in sync by the index itself on PostgreSQL
+# and by triggers on SQLite, see migration 0026.
+USER_SEARCH_TABLE = "games_user_search"
+
+# The trigram tokenizer of FTS5 was added in SQLite 3.34,
+# on older versions usernames are searched without the index
+SQLITE_TRIGRAM_VERSION = (3, 34, 0)
+
+USER_SEARCH_TRIGGERS = {
+    "games_user_search_insert": (
+        "AFTER INSERT ON games_user BEGIN "
+        "INSERT INTO games_user_search(rowid, username) "
+        "VALUES (new.id, new.username); "
+        "END"
+    ),
+    "games_user_search_delete": (
+        "AFTER DELETE ON games_user BEGIN "
+        "INSERT INTO games_user_search(games_user_search, rowid, username) "
+        "VALUES ('delete', old.id, old.username); "
+        "END"
+    ),
+    "games_user_search_update": (
+        "AFTER UPDATE OF username ON games_user BEGIN "
+        "INSERT INTO games_user_search(games_user_search, rowid, username) "
+        "VALUES ('delete', old.id, old.username); "
+        "INSERT INTO games_user_search(rowid, username) "
+        "VALUES (new.id, new.username); "
+        "END"
+    ),
+}
+
+
+def get_hashtags(description):
+    """
+    Returns the distinct lowercased hashtags in a description, without the #.
+    """
+    return sorted({tag.lower() for tag in HASHTAG_RE.findall(description)})
+
+
+def hashtags_for_game(game):
+    return [
+        GameHashtag(game_id=game.id, tag=tag) for tag in get_hashtags(game.description)
+    ]
+
+
+def update_game_hashtags(game):
+    GameHashtag.objects.filter(game=game).delete()
+    GameHashtag.objects.bulk_create(hashtags_for_game(game))
+
+
+def rebuild_hashtags(games, chunk_size=1000):
+    GameHashtag.objects.filter(game__in=games).delete()
+    hashtags = []
+    for game in games.exclude(description="").only("id", "description").iterator():
+        hashtags += hashtags_for_game(game)
+    GameHashtag.objects.bulk_create(hashtags, batch_size=chunk_size)
+
+
+def escape_like(s):
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def can_have_user_search_table(connection):
+    return (
+        connection.vendor == "sqlite"
+        and sqlite3.sqlite_version_info >= SQLITE_TRIGRAM_VERSION
+    )
+
+
+def has_user_search_table(connection):
+    """
+    Returns whether the username index exists, which it doesn't,
+    if the database was migrated with a SQLite older than 3.34.
+    Cached on the connection, and reset by ensure_user_search_triggers.
+    """
+    if not can_have_user_search_table(connection):
+        return False
+
+    if not hasattr(connection, "_has_user_search_table"):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+                [USER_SEARCH_TABLE],
+            )
+            connection._has_user_search_table = cursor.fetchone() is not None
+
+    return connection._has_user_search_table
+
+
+def ensure_user_search_triggers(using="default", **kwargs):
+    """
+    Recreates the triggers of the username index on SQLite,
+    which are dropped when a migration makes SQLite remake the user table,
+    and rebuilds the index if any of them were missing.
+    Connected to post_migrate in GamesConfig.
+    """
+    connection = connections[using]
+    if not can_have_user_search_table(connection):
+        return
+
+    # The migrations may have created or dropped the table
+    connection.__dict__.pop("_has_user_search_table", None)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name, type FROM sqlite_master WHERE name = %s OR tbl_name = %s",
+            [USER_SEARCH_TABLE, "games_user"],
+        )
+        existing = {name for name, type in cursor.fetchall()}
+
+        # Not created yet, or the migration has been reversed
+        if USER_SEARCH_TABLE not in existing:
+            return
+
+        missing = USER_SEARCH_TRIGGERS.keys() - existing
+        if not missing:
+            return
+
+        for name in missing:
+            cursor.execute(f"CREATE TRIGGER {name} {USER_SEARCH_TRIGGERS[name]}")
+        cursor.execute(
+            f"INSERT INTO {USER_SEARCH_TABLE}({USER_SEARCH_TABLE}) VALUES ('rebuild')"
+        )
+
+
+def search_users(part):
+    """
+    Returns the users with part in their username, ignoring case.
+    """
+    if has_user_search_table(connection):
+        return User.objects.filter(
+            id__in=RawSQL(
+                f"SELECT rowid FROM {USER_SEARCH_TABLE} "
+                "WHERE username LIKE %s ESCAPE '\\'",
+                [f"%{escape_like(part)}%"],
+            )
+        )
+
+    # Uses the trigram index on UPPER(username) on PostgreSQL
+    return User.objects.filter(username__icontains=part)
+
+
+def search_games(qs, query):
+    """
+    Filters the games by every part of the query,
+    where parts starting with # are hashtag prefixes
+    and other parts are matched against the usernames of the players.
+    """
+    qs = qs.all()
+    for part in re.split(r"[\s,]", query):
+        part = part.strip()
+        if part == "":
+            continue
+
+        if part[0] == "#":
+            game_ids = GameHashtag.objects.filter(
+                tag__startswith=part[1:].lower()
+            ).values("game_id")
+        else:
+            game_ids = GamePlayer.objects.filter(user__in=search_users(part)).values(
+                "game_id"
+            )
+
+        qs = qs.filter(id__in=Subquery(game_ids))
+
+    return qs
@@ -1,13 +1,14 @@
 import datetime
-import re
 from urllib.parse import urlencode
 
 from django.urls import reverse
 from django.utils.html import format_html
-from rest_framework import serializers
+from rest_framework import serializers, status
 from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import APIException
 
 from .models import Card, Chug, Game, GamePlayer, PlayerStat, User
+from .search import HASHTAG_RE
 from .seed import is_seed_valid_for_players
 
 
@@ -48,7 +49,7 @@ class CreateGameSerializer(serializers.Serializer):
         return users
 
     def create(self, validated_data):
-        game = Game.objects.create()
+        game = Game.objects.create(player_count=len(validated_data["tokens"]))
         for i, user in enumerate(validated_data["tokens"]):
             GamePlayer.objects.create(game=game, user=user, position=i)
 
@@ -156,7 +157,7 @@ class GameSerializer(serializers.ModelSerializer):
     )
     location = LocationSerializer(required=False, source="*")
 
-    hashtag_re = re.compile(r"#([^# ]+)")
+    hashtag_re = HASHTAG_RE
 
     def get_description_html(self, obj):
         def hashtag_link(m):
@@ -198,7 +199,7 @@ class GameSerializer(serializers.ModelSerializer):
         check_field("official")
         check_field("description", "")
 
-        cards = self.instance.ordered_cards()
+        cards = list(self.instance.ordered_cards().select_related("chug"))
         new_cards = data["cards"]
 
         ended = data["has_ended"]
@@ -217,7 +218,7 @@ class GameSerializer(serializers.ModelSerializer):
         previous_cards = len(cards)
 
         player_count = len(data["player_names"])
-        instance_player_count = self.instance.players.count()
+        instance_player_count = self.instance.player_count
         if instance_player_count > 0:
             if player_count != instance_player_count:
                 raise serializers.ValidationError(
@@ -234,9 +235,14 @@ class GameSerializer(serializers.ModelSerializer):
                     }
                 )
 
+        # The stored seed has already been validated
         seed = data["seed"]
-        if not is_seed_valid_for_players(seed, player_count):
-            raise serializers.ValidationError({"seed": "Invalid seed"})
+        server_seed = self.instance.get_seed()
+        if server_seed is None:
+            if not is_seed_valid_for_players(seed, player_count):
+                raise serializers.ValidationError({"seed": "Invalid seed"})
+        elif seed != server_seed:
+            raise serializers.ValidationError({"seed": "Differs from server value"})
         seed_cards = Card.get_shuffled_deck(player_count, seed)
 
         if len(cards) > len(new_cards):
@@ -372,6 +378,199 @@ class GameSerializer(serializers.ModelSerializer):
         return data
 
 
+class SequenceConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Sequence doesn't match server"
+    default_code = "sequence_conflict"
+
+    def __init__(self, sequence):
+        super().__init__()
+        # Kept as an int, so the client can continue from it
+        self.detail = {"detail": self.detail, "sequence": sequence}
+
+
+class ChugDeltaSerializer(serializers.Serializer):
+    chug_start_start_delta_ms = serializers.IntegerField()
+    chug_end_start_delta_ms = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        if "chug_end_start_delta_ms" in data:
+            data["chug_duration_ms"] = (
+                data["chug_end_start_delta_ms"] - data["chug_start_start_delta_ms"]
+            )
+
+        return data
+
+
+class GameDeltaSerializer(serializers.Serializer):
+    """
+    Validates an update containing only the cards drawn since sequence,
+    which is the number of cards on the server,
+    and the chug of the last of those cards.
+
+    Unlike GameSerializer, this only needs the game, its players and
+    last card from the database, so the work doesn't grow with the game.
+    """
+
+    sequence = serializers.IntegerField(min_value=0)
+    cards = CardSerializer(many=True, required=False, default=list)
+    last_chug = ChugDeltaSerializer(required=False)
+    has_ended = serializers.BooleanField(required=True)
+    dnf = serializers.BooleanField(required=False, default=False)
+    dnf_player_ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, default=list
+    )
+    description = serializers.CharField(required=False, max_length=1000)
+    location = LocationSerializer(required=False, source="*")
+
+    def validate(self, data):
+        game = self.instance
+        if game.has_ended:
+            raise serializers.ValidationError({"non_field_errors": "Game has finished"})
+
+        seed = game.get_seed()
+        if seed is None:
+            raise serializers.ValidationError(
+                {"non_field_errors": "Full game state must be sent first"}
+            )
+
+        last_card = game.ordered_cards().select_related("chug").last()
+        sequence = last_card.index + 1 if last_card else 0
+        if data["sequence"] != sequence:
+            raise SequenceConflict(sequence)
+
+        ended = data["has_ended"]
+        dnf = data["dnf"]
+        completed = ended and not dnf
+        if not completed and data.get("description") != None:
+            raise serializers.ValidationError(
+                {"description": "Can't set description before game has ended"}
+            )
+
+        if dnf and not ended:
+            raise serializers.ValidationError(
+                {"dnf": "has_ended must be true if dnf is true"}
+            )
+
+        player_ids = list(game.ordered_gameplayers().values_list("user_id", flat=True))
+        if not (set(data["dnf_player_ids"]) <= set(player_ids)):
+            raise serializers.ValidationError(
+                {"dnf_player_ids": "dnf_player_ids is not a subset of player_ids"}
+            )
+
+        new_cards = data["cards"]
+        seed_cards = Card.get_shuffled_deck(game.player_count, seed)
+        card_count = sequence + len(new_cards)
+        if card_count > len(seed_cards):
+            raise serializers.ValidationError(
+                {"cards": "More cards than expected for the game"}
+            )
+
+        if completed and card_count < len(seed_cards):
+            raise serializers.ValidationError(
+                {"cards": "Can't end game before drawing every card"}
+            )
+
+        for i, card_data in enumerate(new_cards, sequence):
+            if seed_cards[i] != (card_data["value"], card_data["suit"]):
+                raise serializers.ValidationError(
+                    {"cards": f"Card {i} has different data than seed would generate"}
+                )
+
+        previous_delta = 0
+        chug = None
+        if last_card:
+            previous_delta = last_card.start_delta_ms
+            chug = getattr(last_card, "chug", None)
+            if chug and chug.start_start_delta_ms:
+                previous_delta = chug.start_start_delta_ms
+            if chug and chug.duration_ms:
+                previous_delta = last_card.finish_start_delta_ms
+
+        last_chug = data.get("last_chug")
+        chug_finished = bool(chug and chug.duration_ms)
+        if last_chug:
+            if not last_card or last_card.value != Chug.VALUE:
+                raise serializers.ValidationError(
+                    {"last_chug": "Last card on server is not an ace"}
+                )
+
+            if chug_finished:
+                raise serializers.ValidationError(
+                    {"last_chug": "Chug has already finished on server"}
+                )
+
+            if chug and chug.start_start_delta_ms:
+                if last_chug["chug_start_start_delta_ms"] != chug.start_start_delta_ms:
+                    raise serializers.ValidationError(
+                        {"last_chug": "Chug start differs from server value"}
+                    )
+                previous_delta = last_card.start_delta_ms
+
+            chug_finished = "chug_duration_ms" in last_chug
+
+        if (
+            last_card
+            and last_card.value == Chug.VALUE
+            and not chug_finished
+            and (new_cards or completed)
+        ):
+            raise serializers.ValidationError(
+                {"last_chug": f"Card {sequence - 1} has missing chug data"}
+            )
+
+        increasing_deltas = []
+        if last_chug:
+            for f in CHUG_FIELDS:
+                if f in last_chug:
+                    increasing_deltas.append(last_chug[f])
+
+        for card_data in new_cards:
+            increasing_deltas.append(card_data["start_delta_ms"])
+
+            for f in CHUG_FIELDS:
+                if f in card_data:
+                    increasing_deltas.append(card_data[f])
+
+        for delta in increasing_deltas:
+            if delta < 0:
+                raise serializers.ValidationError(
+                    {"cards": "Card times are not non-negative"}
+                )
+
+            if delta < previous_delta:
+                raise serializers.ValidationError(
+                    {
+                        "cards": f"Card times are not increasing: {delta} < {previous_delta}"
+                    }
+                )
+
+            previous_delta = delta
+
+        for i, card_data in enumerate(new_cards, sequence):
+            if (
+                card_data["value"] == Chug.VALUE
+                and "chug_end_start_delta_ms" not in card_data
+            ):
+                if i != card_count - 1 or completed:
+                    raise serializers.ValidationError(
+                        {"cards": f"Card {i} has missing chug data"}
+                    )
+
+        if completed:
+            if new_cards:
+                end_start_delta_ms = new_cards[-1]["start_delta_ms"]
+            else:
+                end_start_delta_ms = last_card.start_delta_ms
+
+            data["end_datetime"] = game.start_datetime + datetime.timedelta(
+                milliseconds=end_start_delta_ms
+            )
+
+        data["last_card"] = last_card
+        return data
+
+
 class GameSerializerWithPlayerStats(GameSerializer):
     class Meta(GameSerializer.Meta):
         fields = GameSerializer.Meta.fields + ["player_stats"]
@@ -389,6 +588,37 @@ class GameSerializerWithPlayerStats(GameSerializer):
         return l
 
 
+class GameUpdateSerializer(serializers.ModelSerializer):
+    """
+    The fields of GameSerializer, that can change during a game, see games.live.
+    The cards and the player stats are left out, as they would cost O(cards).
+    """
+
+    class Meta:
+        model = Game
+        fields = [
+            "end_datetime",
+            "dnf",
+            "has_ended",
+            "description",
+            "description_html",
+            "dnf_player_ids",
+        ]
+
+    has_ended = serializers.BooleanField()
+    description_html = serializers.SerializerMethodField()
+    dnf_player_ids = serializers.SerializerMethodField()
+
+    hashtag_re = HASHTAG_RE
+
+    get_description_html = GameSerializer.get_description_html
+
+    def get_dnf_player_ids(self, obj):
+        return list(
+            obj.gameplayer_set.filter(dnf=True).values_list("user_id", flat=True)
+        )
+
+
 class PlayerStatSerializer(serializers.ModelSerializer):
     class Meta:
         model = PlayerStat
@@ -0,0 +1,68 @@
+import gzip
+import json
+
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+
+from .models import Card, GameSnapshot
+from .serializers import GameSerializerWithPlayerStats
+
+
+def get_game_snapshot(game_id):
+    """
+    Returns the stored snapshot of the game, or None if it has none.
+    """
+    data = (
+        GameSnapshot.objects.filter(game_id=game_id)
+        .values_list("data", flat=True)
+        .first()
+    )
+    return None if data is None else bytes(data)
+
+
+def create_game_snapshot(game):
+    """
+    Serializes the ended game and stores it as its snapshot.
+    """
+    prefetch_related_objects(
+        [game], Prefetch("cards", queryset=Card.objects.select_related("chug"))
+    )
+
+    data = gzip.compress(
+        JSONRenderer().render(GameSerializerWithPlayerStats(game).data)
+    )
+    GameSnapshot.objects.update_or_create(game=game, defaults={"data": data})
+    return data
+
+
+def get_or_create_game_snapshot(game):
+    """
+    Returns the snapshot of the game, or None if the game hasn't ended.
+    """
+    if not game.has_ended:
+        return None
+
+    return get_game_snapshot(game.id) or create_game_snapshot(game)
+
+
+def load_game_snapshot(snapshot):
+    return json.loads(gzip.decompress(snapshot))
+
+
+def game_snapshot_response(request, snapshot):
+    """
+    Returns the snapshot as a JSON response, without decompressing it
+    if the client accepts gzip.
+    """
+    if "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", ""):
+        response = HttpResponse(snapshot, content_type="application/json")
+        response["Content-Encoding"] = "gzip"
+    else:
+        response = HttpResponse(
+            gzip.decompress(snapshot), content_type="application/json"
+        )
+
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
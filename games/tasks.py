@@ -1,9 +1,15 @@
 import datetime
 
 from celery import shared_task
+from django.db import transaction
 from django.utils import timezone
 
-from .models import Game, recalculate_all_stats
+from .models import (
+    Game,
+    GameFinishedStage,
+    get_game_finished_stages,
+    recalculate_all_stats,
+)
 
 
 @shared_task
@@ -14,8 +20,40 @@ def mark_dnf_games():
         if timezone.now() - game.get_last_activity_time() >= DNF_THRESHOLD:
             game.dnf = True
             game.save()
+            # Updates the stats including dnf games, as when a game is marked dnf
+            process_finished_game.delay(game.id)
 
 
 @shared_task
 def recalculate_stats():
     recalculate_all_stats()
+
+
+# Stages making requests to external services, which are run outside
+# of a transaction, as they would otherwise hold the lock on the game
+UNLOCKED_STAGES = {"facebook_post"}
+
+
+@shared_task(autoretry_for=(Exception,), retry_backoff=True, max_retries=5)
+def process_finished_game(game_id):
+    """
+    Runs the stages of get_game_finished_stages for the game.
+    Every stage is recorded as done in the transaction it runs in,
+    or once it has succeeded for unlocked stages,
+    so a retried task continues from the stage that failed.
+    """
+    for key, stage in get_game_finished_stages():
+        if key in UNLOCKED_STAGES:
+            done = GameFinishedStage.objects.filter(game_id=game_id, key=key)
+            if not done.exists():
+                # May run twice for duplicated tasks, so it must be idempotent
+                stage(Game.objects.get(id=game_id))
+                GameFinishedStage.objects.get_or_create(game_id=game_id, key=key)
+            continue
+
+        with transaction.atomic():
+            # Lock the game, so the same stage isn't run concurrently
+            game = Game.objects.select_for_update().get(id=game_id)
+            _, created = GameFinishedStage.objects.get_or_create(game=game, key=key)
+            if created:
+                stage(game)
@@ -1,18 +1,76 @@
 import concurrent.futures
 import datetime
+import gzip
+import json
+import os
+import shutil
+import subprocess
+from collections import Counter
 from copy import deepcopy
 from threading import Lock
 from time import sleep
 from unittest.mock import patch
 
-from django.test import TransactionTestCase, skipUnlessDBFeature
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 
-from games.models import Card, Chug, Game, OneTimePassword, User
-from games.serializers import GameSerializer
+from games.achievements import (
+    ACHIEVEMENTS,
+    TheBarrelAchievement,
+    evaluate_achievements,
+)
+from games.fake_data import FakeGameGenerator, create_fake_users
+from games.histogram import duration_microseconds, get_histogram
+from games.live import get_game_update
+from games.models import (
+    Card,
+    Chug,
+    DailyGameCount,
+    Game,
+    GameFinishedStage,
+    GameHashtag,
+    GamePlayer,
+    GamePlayerStat,
+    OneTimePassword,
+    PlayedWithCount,
+    PlayerStat,
+    RankingEntry,
+    Season,
+    User,
+    UserAchievement,
+    all_time_season,
+    filter_season,
+    get_game_finished_stages,
+    recalculate_all_stats,
+    update_stats_on_game_finished,
+)
+from games.ranking import (
+    RANKINGS,
+    count_ranks,
+    get_ranks,
+    rebuild_leaderboards,
+    update_leaderboards_on_game_finished,
+)
+from games.search import (
+    ensure_user_search_triggers,
+    get_hashtags,
+    has_user_search_table,
+    search_games,
+)
+from games.serializers import (
+    GameSerializer,
+    GameSerializerWithPlayerStats,
+    GameUpdateSerializer,
+)
+from games.tasks import mark_dnf_games, process_finished_game
 from games.utils import get_milliseconds
-from games.views import update_game
+from games.views import update_game, update_game_state
 
 
 class ApiTest(TransactionTestCase):
@@ -61,6 +119,33 @@ class ApiTest(TransactionTestCase):
             self.assert_status(r, expected_status)
         return r
 
+    def update_game_delta(self, delta_data, expected_status=200):
+        r = self.client.post(
+            f"/api/games/{self.game_id}/update_state_delta/", delta_data, format="json"
+        )
+        if expected_status:
+            self.assert_status(r, expected_status)
+        return r
+
+    def get_delta_data(self, sequence, cards_drawn, include_chug=True):
+        cards = deepcopy(self.final_game_data["cards"])
+        delta_data = {
+            "sequence": sequence,
+            "cards": cards[sequence:cards_drawn],
+            "has_ended": False,
+        }
+
+        if not include_chug:
+            for card_data in delta_data["cards"][-1:]:
+                card_data.pop("chug_end_start_delta_ms", None)
+
+        if sequence > 0 and cards[sequence - 1]["value"] == Chug.VALUE:
+            delta_data["last_chug"] = {
+                k: v for k, v in cards[sequence - 1].items() if k.startswith("chug_")
+            }
+
+        return delta_data
+
     def get_game_data(self, cards_drawn, include_chug=True):
         game_state = deepcopy(self.final_game_data)
         game_state["has_ended"] = False
@@ -195,6 +280,109 @@ class ApiTest(TransactionTestCase):
                     - card_data["chug_start_start_delta_ms"],
                 )
 
+    def test_card_players(self):
+        self.set_token(self.game_token)
+        self.update_game(self.final_game_data)
+        game = Game.objects.get(id=self.game_id)
+
+        self.assertEqual(game.player_count, self.PLAYER_COUNT)
+        for card in game.ordered_cards():
+            self.assertEqual(card.get_user(), [self.u1, self.u2][card.index % 2])
+
+    def test_game_detail_query_count(self):
+        self.set_token(self.game_token)
+        self.update_game(self.final_game_data)
+
+        # Creates the snapshot
+        self.assert_ok(self.client.get(f"/api/games/{self.game_id}/"))
+
+        # The version for the ETag, and the snapshot
+        with self.assertNumQueries(2):
+            r = self.client.get(f"/api/games/{self.game_id}/")
+            self.assert_ok(r)
+
+    def test_game_not_modified_until_updated(self):
+        self.set_token(self.game_token)
+        self.update_game(self.get_game_data(3))
+
+        etag = self.client.get(f"/api/games/{self.game_id}/")["ETag"]
+        r = self.client.get(f"/api/games/{self.game_id}/", HTTP_IF_NONE_MATCH=etag)
+        self.assert_status(r, 304)
+
+        self.update_game_delta(self.get_delta_data(3, 4))
+        r = self.client.get(f"/api/games/{self.game_id}/", HTTP_IF_NONE_MATCH=etag)
+        self.assert_ok(r)
+
+    def test_game_snapshot(self):
+        self.set_token(self.game_token)
+        self.update_game(self.final_game_data)
+
+        r = self.client.get(f"/api/games/{self.game_id}/")
+        self.assertEqual(r["Content-Type"], "application/json")
+        data = json.loads(r.content)
+
+        game = Game.prefetch_cards(Game.objects).get(id=self.game_id)
+        expected = GameSerializerWithPlayerStats(game).data
+        self.assertEqual(data, json.loads(json.dumps(expected)))
+
+        r = self.client.get(
+            f"/api/games/{self.game_id}/", HTTP_ACCEPT_ENCODING="gzip, deflate"
+        )
+        self.assertEqual(r["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(r.content)), data)
+
+        self.u1.username = "Renamed"
+        self.u1.save()
+
+        data = json.loads(self.client.get(f"/api/games/{self.game_id}/").content)
+        self.assertEqual(data["player_stats"][0]["username"], "Renamed")
+
+    def get_full_game_data(self, player_count, start_datetime):
+        users = [self.u1, self.u2, self.u3]
+        for i in range(len(users), player_count):
+            users.append(self.create_user(f"Player{i + 1}", "test")[0])
+        users = users[:player_count]
+
+        game_data = {
+            "start_datetime": start_datetime,
+            "official": True,
+            "seed": list(range(player_count * 13 - 1, 0, -1)),
+            "cards": [],
+            "player_ids": [u.id for u in users],
+            "player_names": [u.username for u in users],
+            "has_ended": False,
+            "dnf": False,
+        }
+
+        delta = 0
+        for value, suit in Card.get_ordered_cards_for_players(player_count):
+            delta += 1000
+            card_data = {"value": value, "suit": suit, "start_delta_ms": delta}
+            if value == Chug.VALUE:
+                card_data["chug_start_start_delta_ms"] = delta + 100
+                card_data["chug_end_start_delta_ms"] = delta + 200
+
+            game_data["cards"].append(card_data)
+
+        return users, game_data
+
+    def test_full_upload_query_count(self):
+        game = Game.objects.create()
+        users, game_data = self.get_full_game_data(6, game.start_datetime)
+
+        s = GameSerializer(game, data=game_data)
+        self.assertTrue(s.is_valid(), s.errors)
+
+        # One more query to get the card ids, where bulk_create can't return them
+        queries = 8 if connection.features.can_return_rows_from_bulk_insert else 9
+        with transaction.atomic(), self.assertNumQueries(queries):
+            update_game(game, s.validated_data)
+
+        self.assertEqual(game.cards.count(), 6 * 13)
+        self.assertEqual(Chug.objects.filter(card__game=game).count(), 6)
+        for card in game.ordered_cards():
+            self.assertEqual(card.get_user(), users[card.index % 6])
+
     def test_send_final(self):
         self.set_token(self.game_token)
         self.update_game(self.final_game_data)
@@ -223,6 +411,128 @@ class ApiTest(TransactionTestCase):
     def test_send_all_with_chug(self):
         self.send_all_updates(False, True)
 
+    def test_send_all_delta(self):
+        self.set_token(self.game_token)
+        r = self.update_game(self.get_game_data(0))
+        self.assertEqual(r.data, {"sequence": 0})
+
+        for i in range(1, self.TOTAL_CARDS + 1):
+            r = self.update_game_delta(self.get_delta_data(i - 1, i, False))
+            self.assertEqual(r.data, {"sequence": i})
+
+        delta_data = self.get_delta_data(self.TOTAL_CARDS, self.TOTAL_CARDS)
+        delta_data["has_ended"] = True
+        delta_data["description"] = "foo"
+        self.update_game_delta(delta_data)
+
+        game = Game.objects.get(id=self.game_id)
+        self.assertTrue(game.has_ended)
+        self.assertEqual(game.description, "foo")
+        self.assertEqual(game.get_seed(), self.SEED)
+
+        cards = list(game.ordered_cards())
+        self.assertEqual(len(cards), self.TOTAL_CARDS)
+        for card, card_data in zip(cards, self.final_game_data["cards"]):
+            for f in ["value", "suit", "start_delta_ms"]:
+                self.assertEqual(getattr(card, f), card_data[f])
+
+            self.assertEqual(hasattr(card, "chug"), card.value == Chug.VALUE)
+            if card.value == Chug.VALUE:
+                self.assertEqual(
+                    card.chug.duration_ms,
+                    card_data["chug_end_start_delta_ms"]
+                    - card_data["chug_start_start_delta_ms"],
+                )
+
+    def test_delta_query_count_is_constant(self):
+        self.set_token(self.game_token)
+        self.update_game(self.get_game_data(1))
+
+        with CaptureQueriesContext(connection) as early:
+            self.update_game_delta(self.get_delta_data(1, 2))
+
+        self.update_game(self.get_game_data(20))
+
+        with CaptureQueriesContext(connection) as late:
+            self.update_game_delta(self.get_delta_data(20, 21))
+
+        self.assertEqual(len(early), len(late))
+
+    def test_live_update(self):
+        self.set_token(self.game_token)
+        self.update_game(self.get_game_data(3))
+
+        with patch("games.live.get_game_update", wraps=get_game_update) as mock:
+            self.update_game_delta(self.get_delta_data(3, 5))
+
+        data = self.client.get(f"/api/games/{self.game_id}/").data
+        update = get_game_update(*mock.call_args[0])
+
+        self.assertEqual(update["first_index"], 2)
+        self.assertEqual(update["cards"], data["cards"][2:])
+        self.assertEqual(update["has_ended"], data["has_ended"])
+        self.assertEqual(update["dnf_player_ids"], [])
+        self.assertNotIn("player_stats", update)
+
+    def test_live_update_failure_does_not_fail_update(self):
+        self.set_token(self.game_token)
+        self.update_game(self.get_game_data(3))
+
+        with patch("games.live.get_channel_layer", side_effect=ConnectionError):
+            self.update_game_delta(self.get_delta_data(3, 5))
+
+        self.assertEqual(Card.objects.filter(game_id=self.game_id).count(), 5)
+
+    def test_no_live_update_after_game_ended(self):
+        self.set_token(self.game_token)
+        self.update_game(self.final_game_data)
+
+        # As when the game is edited in the admin
+        game = Game.objects.get(id=self.game_id)
+        with patch("games.live.get_game_update") as mock:
+            update_game_state(game, {"dnf": False, "dnf_player_ids": []}, True, 0)
+
+        mock.assert_not_called()
+
+    def test_delta_sequence_conflict(self):
+        self.set_token(self.game_token)
+        self.update_game(self.get_game_data(3))
+
+        r = self.update_game_delta(self.get_delta_data(2, 4), 409)
+        self.assertEqual(r.data["sequence"], 3)
+
+        # The full state can still be sent
+        self.update_game(self.get_game_data(4))
+        self.update_game_delta(self.get_delta_data(4, 5))
+
+    def test_delta_before_full_state(self):
+        self.set_token(self.game_token)
+        self.update_game_delta(self.get_delta_data(0, 1), 400)
+
+    def test_delta_wrong_card(self):
+        self.set_token(self.game_token)
+        self.update_game(self.get_game_data(0))
+
+        delta_data = self.get_delta_data(0, 1)
+        delta_data["cards"][0]["value"] = 3
+        self.update_game_delta(delta_data, 400)
+
+    def test_delta_decreasing_times(self):
+        self.set_token(self.game_token)
+        self.update_game(self.get_game_data(2))
+
+        delta_data = self.get_delta_data(2, 3)
+        delta_data["cards"][0]["start_delta_ms"] = 0
+        self.update_game_delta(delta_data, 400)
+
+    def test_delta_different_seed(self):
+        self.set_token(self.game_token)
+        self.update_game(self.get_game_data(1))
+
+        game_data = self.get_game_data(2)
+        game_data["seed"] = [0] * (self.TOTAL_CARDS - 1)
+        self.update_game(game_data, 400)
+
     def test_send_wrong_card(self):
         self.set_token(self.game_token)
 
@@ -468,3 +778,609 @@ class ApiTest(TransactionTestCase):
         game_data = self.get_game_data(7)
         del game_data["dnf"]
         self.update_game(game_data)
+
+
+def get_player_stat_rows():
+    fields = ["user_id", "season_number"] + [
+        f"{f}_id" if f in ["best_game", "worst_game", "fastest_chug"] else f
+        for f in PlayerStat.stat_fields()
+    ]
+    # The float sums depend on the order the games are added in
+    return {
+        tuple(round(v, 6) if isinstance(v, float) else v for v in row)
+        for row in PlayerStat.objects.values_list(*fields)
+    }
+
+
+class FakeGamesTestCase(TestCase):
+    """
+    Creates GAME_COUNT fake games played by USER_COUNT users
+    in the fixed seasons 8 and 9, where self.generator creates more.
+    """
+
+    USER_COUNT = 8
+    GAME_COUNT = 30
+    RANDOM_SEED = 1
+    FIRST_DATETIME = Season(8).start_datetime
+    LAST_DATETIME = Season(9).end_datetime
+
+    def setUp(self):
+        self.users = create_fake_users(self.USER_COUNT)
+        self.generator = FakeGameGenerator(
+            self.users,
+            random_seed=self.RANDOM_SEED,
+            first_datetime=self.FIRST_DATETIME,
+            last_datetime=self.LAST_DATETIME,
+        )
+        self.generator.create_games(self.GAME_COUNT)
+        self.finished_game_count = 0
+
+    def create_finished_game(self):
+        """
+        Creates a game that has just finished,
+        on the day after the previous one and after all the other games.
+        """
+        self.finished_game_count += 1
+        first_datetime = self.LAST_DATETIME + datetime.timedelta(
+            days=self.finished_game_count
+        )
+        FakeGameGenerator(
+            self.users,
+            random_seed=self.RANDOM_SEED + self.finished_game_count,
+            dnf_ratio=0,
+            first_datetime=first_datetime,
+            last_datetime=first_datetime + datetime.timedelta(hours=12),
+        ).create_games(1)
+        return Game.objects.latest("id")
+
+
+class PlayerStatTest(FakeGamesTestCase):
+    GAME_COUNT = 40
+
+    def test_bulk_recalculate_matches_slow(self):
+        PlayerStat.recalculate_all(bulk=False)
+        slow_rows = get_player_stat_rows()
+
+        PlayerStat.objects.all().delete()
+        PlayerStat.recalculate_all(bulk=True)
+        self.assertEqual(get_player_stat_rows(), slow_rows)
+
+        # Updates existing rows too
+        PlayerStat.recalculate_all(bulk=True)
+        self.assertEqual(get_player_stat_rows(), slow_rows)
+
+    def test_recalculate_user(self):
+        PlayerStat.recalculate_all()
+        rows = get_player_stat_rows()
+
+        user = self.users[0]
+        PlayerStat.objects.filter(user=user).update(total_sips=0, total_games=0)
+        PlayerStat.recalculate_user(user)
+        self.assertEqual(get_player_stat_rows(), rows)
+
+
+class GameFinishedTest(FakeGamesTestCase):
+    RANDOM_SEED = 6
+
+    def get_stats_rows(self):
+        return {
+            "player_stats": get_player_stat_rows(),
+            "game_player_stats": set(
+                GamePlayerStat.objects.values_list("gameplayer", "value_sum", "chugs")
+            ),
+            "daily_game_counts": set(
+                DailyGameCount.objects.values_list(
+                    "date", "player_count", "user", "count"
+                )
+            ),
+            "played_with_counts": set(
+                PlayedWithCount.objects.values_list(
+                    "user", "other_user", "season_number", "count"
+                )
+            ),
+            "ranking_entries": set(
+                RankingEntry.objects.values_list(
+                    "season_number", "key", "rank", "user_id", "value", "game_id"
+                )
+            ),
+            "achievements": set(UserAchievement.objects.values_list("user", "key")),
+        }
+
+    def test_process_finished_game_matches_recalculate(self):
+        recalculate_all_stats()
+
+        for _ in range(5):
+            process_finished_game(self.create_finished_game().id)
+
+            rows = self.get_stats_rows()
+            recalculate_all_stats()
+            self.assertEqual(self.get_stats_rows(), rows)
+
+    def test_process_finished_game_runs_stages_once(self):
+        recalculate_all_stats()
+        game = self.create_finished_game()
+
+        process_finished_game(game.id)
+        rows = self.get_stats_rows()
+        self.assertEqual(
+            GameFinishedStage.objects.filter(game=game).count(),
+            len(get_game_finished_stages()),
+        )
+
+        # A retried or duplicated task doesn't add the game again
+        process_finished_game(game.id)
+        self.assertEqual(self.get_stats_rows(), rows)
+
+
+class RankingTest(FakeGamesTestCase):
+    # Few games per user, so many stats are tied
+    USER_COUNT = 12
+    GAME_COUNT = 20
+    RANDOM_SEED = 2
+
+    def setUp(self):
+        super().setUp()
+        PlayerStat.recalculate_all()
+        rebuild_leaderboards()
+
+    def get_entries(self):
+        return set(
+            RankingEntry.objects.values_list(
+                "season_number", "key", "rank", "user_id", "value", "game_id"
+            )
+        )
+
+    def test_ranks_match_ordering(self):
+        for season in [Season(9), all_time_season]:
+            for user in self.users:
+                ranks = get_ranks(user, season)
+                counted_ranks = count_ranks(user, season)
+                for ranking in RANKINGS:
+                    ordered = list(
+                        ranking.get_qs(season).values_list("user_id", flat=True)
+                    )
+                    expected = (
+                        ordered.index(user.id) + 1 if user.id in ordered else None
+                    )
+                    self.assertEqual(ranks[ranking.key], expected)
+                    self.assertEqual(counted_ranks[ranking.key], expected)
+                    self.assertEqual(ranking.get_rank(user, season), expected)
+
+    def test_ranks_query_count(self):
+        with self.assertNumQueries(1):
+            get_ranks(self.users[0], all_time_season)
+
+        with self.assertNumQueries(2):
+            count_ranks(self.users[0], all_time_season)
+
+    def test_update_leaderboards_on_game_finished(self):
+        for _ in range(10):
+            self.generator.create_games(1)
+            game = Game.objects.latest("id")
+            PlayerStat.update_on_game_finished(game)
+            update_leaderboards_on_game_finished(game)
+
+            entries = self.get_entries()
+            rebuild_leaderboards()
+            self.assertEqual(self.get_entries(), entries)
+
+
+class AchievementTest(FakeGamesTestCase):
+    USER_COUNT = 15
+    GAME_COUNT = 60
+    RANDOM_SEED = 3
+
+    def setUp(self):
+        super().setUp()
+        PlayerStat.recalculate_all()
+        rebuild_leaderboards()
+
+    def get_achievements(self):
+        return set(UserAchievement.objects.values_list("user_id", "key"))
+
+    def test_evaluate_matches_has_achieved(self):
+        evaluate_achievements()
+
+        expected = {
+            (user.id, achievement.key)
+            for achievement in ACHIEVEMENTS
+            for user in self.users
+            if achievement.has_achieved(user)
+        }
+        self.assertEqual(self.get_achievements(), expected)
+
+        # Removes achievements, that are no longer achieved
+        PlayerStat.objects.update(total_sips=0)
+        evaluate_achievements()
+        self.assertNotIn(
+            TheBarrelAchievement.key, {key for _, key in self.get_achievements()}
+        )
+
+    def test_evaluate_on_game_finished(self):
+        evaluate_achievements()
+
+        for _ in range(5):
+            self.generator.create_games(1)
+            update_stats_on_game_finished(Game.objects.latest("id"))
+
+            achievements = self.get_achievements()
+            evaluate_achievements()
+            self.assertEqual(self.get_achievements(), achievements)
+
+
+class GamePlayerStatTest(FakeGamesTestCase):
+    RANDOM_SEED = 2
+
+    def assert_stats_match_cards(self, game):
+        gameplayers = list(game.ordered_gameplayers())
+        value_sums = [0] * len(gameplayers)
+        chugs = [0] * len(gameplayers)
+        for i, c in enumerate(game.ordered_cards()):
+            value_sums[i % len(gameplayers)] += c.value
+            chugs[i % len(gameplayers)] += c.value == Chug.VALUE
+
+        for gp, value_sum, chug_count in zip(gameplayers, value_sums, chugs):
+            self.assertEqual(gp.gameplayerstat.value_sum, value_sum)
+            self.assertEqual(gp.gameplayerstat.chugs, chug_count)
+
+    def test_recalculate_all(self):
+        GamePlayerStat.recalculate_all(chunk_size=7)
+
+        for game in Game.objects.filter(end_datetime__isnull=False):
+            self.assert_stats_match_cards(game)
+
+    def test_update_on_game_finished_is_idempotent(self):
+        game = Game.objects.filter(end_datetime__isnull=False).first()
+        GamePlayerStat.update_on_game_finished(game)
+        GamePlayerStat.update_on_game_finished(game)
+
+        self.assertEqual(
+            GamePlayerStat.objects.count(), game.gameplayer_set.count(),
+        )
+        self.assert_stats_match_cards(game)
+
+
+class PlayerStatsScriptTest(FakeGamesTestCase):
+    """
+    Checks that getPlayerStats in svelte/src/playerStats.js,
+    which the spectators use for the live updates, agrees with the server.
+    """
+
+    SCRIPT = os.path.join(settings.BASE_DIR, "svelte", "src", "playerStats.js")
+
+    def get_script_player_stats(self, games_data):
+        with open(self.SCRIPT) as f:
+            script = f.read().replace("export ", "")
+
+        script += (
+            "const games = JSON.parse(require('fs').readFileSync(0, 'utf8'));\n"
+            "console.log(JSON.stringify(games.map(getPlayerStats)));\n"
+        )
+        result = subprocess.run(
+            ["node", "-e", script],
+            input=JSONRenderer().render(games_data),
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+        return json.loads(result.stdout)
+
+    def test_same_as_server(self):
+        if not shutil.which("node"):
+            self.skipTest("Node.js is not installed")
+
+        self.generator.create_games(5, live=True)
+        games = Game.prefetch_gameplayers(Game.prefetch_cards(Game.objects))
+
+        games_data = []
+        expected = []
+        for game in games:
+            data = GameSerializerWithPlayerStats(game).data
+            expected.append(json.loads(JSONRenderer().render(data["player_stats"])))
+
+            # As the spectators have it, when an update arrives
+            data.update(GameUpdateSerializer(game).data)
+            data["player_stats"] = [
+                {"id": s["id"], "username": s["username"]} for s in data["player_stats"]
+            ]
+            games_data.append(data)
+
+        self.assertEqual(self.get_script_player_stats(games_data), expected)
+
+
+class GameTest(TestCase):
+    def test_player_stats_without_players(self):
+        game = Game.objects.create(start_datetime=timezone.now())
+        self.assertEqual(list(game.get_player_stats()), [])
+
+    def test_player_stats_use_prefetched_gameplayers(self):
+        FakeGameGenerator(create_fake_users(8), random_seed=2).create_games(1)
+        game = Game.prefetch_gameplayers(Game.prefetch_cards(Game.objects)).get()
+
+        with self.assertNumQueries(0):
+            stats = list(game.get_player_stats())
+
+        self.assertEqual(
+            [s["username"] for s in stats], [u.username for u in game.ordered_players()]
+        )
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.u1 = User.objects.create(username="Alice")
+        self.u2 = User.objects.create(username="Bob_2")
+        self.game1 = Game.objects.create(description="#Academy #rusdag")
+        self.game2 = Game.objects.create(description="#academy#fredagsbar")
+        GamePlayer.objects.create(game=self.game1, user=self.u1, position=0)
+        GamePlayer.objects.create(game=self.game1, user=self.u2, position=1)
+        GamePlayer.objects.create(game=self.game2, user=self.u1, position=0)
+
+    def search(self, query):
+        return set(search_games(Game.objects, query))
+
+    def test_get_hashtags(self):
+        self.assertEqual(get_hashtags("#Foo bar #baz#foo"), ["baz", "foo"])
+
+    def test_hashtags_updated_on_save(self):
+        self.assertEqual(self.search("#rusdag"), {self.game1})
+
+        self.game1.description = "#eksamen"
+        self.game1.save()
+
+        game = Game.objects.get(id=self.game1.id)
+        game.description = "#sommer"
+        game.save()
+
+        self.assertEqual(self.search("#rusdag"), set())
+        self.assertEqual(
+            set(GameHashtag.objects.filter(game=game).values_list("tag", flat=True)),
+            {"sommer"},
+        )
+
+    def test_search(self):
+        self.assertEqual(self.search(""), {self.game1, self.game2})
+        self.assertEqual(self.search("#ACAD"), {self.game1, self.game2})
+        self.assertEqual(self.search("#academy, bob"), {self.game1})
+        self.assertEqual(self.search("lic"), {self.game1, self.game2})
+        self.assertEqual(self.search("b_2"), {self.game1})
+        self.assertEqual(self.search("b%"), set())
+
+    def test_search_renamed_user(self):
+        self.u2.username = "Carol"
+        self.u2.save()
+
+        self.assertEqual(self.search("bob"), set())
+        self.assertEqual(self.search("aro"), {self.game1})
+
+    def test_search_without_user_search_table(self):
+        if not has_user_search_table(connection):
+            self.skipTest("No username index table")
+
+        # As when migrated with a SQLite older than 3.34
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE games_user_search")
+        del connection._has_user_search_table
+
+        try:
+            self.assertEqual(self.search("lic"), {self.game1, self.game2})
+        finally:
+            del connection._has_user_search_table
+
+    def test_user_search_triggers_recreated(self):
+        if not has_user_search_table(connection):
+            self.skipTest("No username index table")
+
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER games_user_search_update")
+
+        self.u2.username = "Carol"
+        self.u2.save()
+        ensure_user_search_triggers()
+
+        self.assertEqual(self.search("bob"), set())
+        self.assertEqual(self.search("aro"), {self.game1})
+
+
+class GameSeasonTest(TestCase):
+    def setUp(self):
+        self.season = Season(10)
+        self.start_datetime = self.season.end_datetime - datetime.timedelta(hours=1)
+        self.game = Game.objects.create(start_datetime=self.start_datetime)
+
+    def test_live_game_has_no_season(self):
+        self.assertIsNone(self.game.season_number)
+        self.assertEqual(self.game.season_number_str(), "-")
+
+    def test_season_set_when_game_ends(self):
+        self.game.end_datetime = self.start_datetime + datetime.timedelta(hours=2)
+        self.game.save()
+
+        self.assertEqual(self.game.get_season(), Season(11))
+        self.assertEqual(list(filter_season(Game.objects, Season(11))), [self.game])
+        self.assertEqual(list(filter_season(Game.objects, self.season)), [])
+        self.assertEqual(
+            list(filter_season(Game.objects, all_time_season)), [self.game]
+        )
+
+    def test_dnf_season_uses_last_card(self):
+        Card.objects.create(
+            game=self.game,
+            index=0,
+            value=2,
+            suit="S",
+            start_delta_ms=2 * 60 * 60 * 1000,
+        )
+        self.game.dnf = True
+        self.game.save()
+
+        self.assertEqual(self.game.season_number, 11)
+
+    def test_fake_games_have_saved_season(self):
+        generator = FakeGameGenerator(
+            create_fake_users(8),
+            random_seed=3,
+            first_datetime=Season(8).start_datetime,
+            last_datetime=Season(9).end_datetime,
+            dnf_ratio=0.5,
+        )
+        generator.create_games(10)
+
+        for game in Game.objects.exclude(id=self.game.id):
+            season_number = game.season_number
+            game.save()
+            self.assertEqual(game.season_number, season_number)
+
+
+class DailyGameCountTest(FakeGamesTestCase):
+    RANDOM_SEED = 3
+
+    def setUp(self):
+        super().setUp()
+        DailyGameCount.recalculate_all()
+
+    def test_recalculate_all(self):
+        games = Game.objects.filter(end_datetime__isnull=False)
+        counts = DailyGameCount.get_counts(datetime.date.min, datetime.date.max)
+        self.assertEqual(sum(counts.values()), games.count())
+
+        user = self.users[0]
+        counts = DailyGameCount.get_counts(
+            datetime.date.min, datetime.date.max, user=user
+        )
+        self.assertEqual(sum(counts.values()), games.filter(players=user).count())
+
+    def get_rows(self):
+        return set(
+            DailyGameCount.objects.values_list("date", "player_count", "user", "count")
+        )
+
+    def get_total(self, user):
+        counts = DailyGameCount.get_counts(
+            datetime.date.min, datetime.date.max, user=user
+        )
+        return sum(counts.values())
+
+    def test_merge_users(self):
+        user, other_user = self.users[:2]
+        total = self.get_total(user) + self.get_total(other_user)
+
+        user.merge_with(other_user)
+        # The heatmap of the user includes the games of the merged user
+        self.assertEqual(self.get_total(user), total)
+
+        rows = self.get_rows()
+        DailyGameCount.recalculate_all()
+        self.assertEqual(self.get_rows(), rows)
+
+    def test_one_row_for_all_games_per_date(self):
+        # As when two games finish concurrently as the first of their date
+        row = DailyGameCount.objects.filter(user=None).first()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DailyGameCount.objects.create(
+                date=row.date, player_count=row.player_count, user=None
+            )
+
+
+class PlayedWithCountTest(FakeGamesTestCase):
+    RANDOM_SEED = 5
+
+    def setUp(self):
+        super().setUp()
+        PlayedWithCount.recalculate_all()
+
+    def test_recalculate_all(self):
+        user = self.users[0]
+        played_with_count = Counter()
+        for game in filter_season(user.games, all_time_season):
+            for player in game.players.all():
+                if player != user:
+                    played_with_count[player.username] += 1
+
+        self.assertEqual(
+            dict(PlayedWithCount.get_counts(user, all_time_season)),
+            dict(played_with_count),
+        )
+
+        other_user = self.users[1]
+        self.assertEqual(
+            PlayedWithCount.get_count(user, other_user, all_time_season),
+            played_with_count[other_user.username],
+        )
+
+    def test_mark_dnf_games(self):
+        user, other_user = self.users[:2]
+        count = PlayedWithCount.get_count(user, other_user, all_time_season)
+
+        game = Game.objects.create(
+            start_datetime=timezone.now() - datetime.timedelta(days=1), player_count=2
+        )
+        GamePlayer.objects.create(game=game, user=user, position=0)
+        GamePlayer.objects.create(game=game, user=other_user, position=1)
+        mark_dnf_games()
+
+        game.refresh_from_db()
+        self.assertTrue(game.dnf)
+        self.assertEqual(
+            GameFinishedStage.objects.filter(game=game).count(),
+            len(get_game_finished_stages()),
+        )
+        self.assertEqual(
+            PlayedWithCount.get_count(user, other_user, all_time_season), count + 1
+        )
+
+
+class HistogramTest(FakeGamesTestCase):
+    RANDOM_SEED = 4
+    BUCKETS = 60
+
+    def setUp(self):
+        super().setUp()
+        GamePlayerStat.recalculate_all()
+
+    def python_histogram(self, values, bucket_span):
+        # The bucketing previously done in StatsView
+        occurrences = Counter(int(value / bucket_span) for value in values)
+        return [occurrences[i] for i in range(self.BUCKETS)]
+
+    def test_game_durations(self):
+        max_duration = datetime.timedelta(hours=1)
+        bucket_span = max_duration / self.BUCKETS
+        games = Game.objects.filter(dnf=False, end_datetime__isnull=False)
+
+        durations = [g.get_duration() for g in games]
+
+        self.assertEqual(
+            get_histogram(
+                games,
+                duration_microseconds("start_datetime", "end_datetime"),
+                bucket_span // datetime.timedelta(microseconds=1),
+                self.BUCKETS,
+            ),
+            self.python_histogram(
+                (d for d in durations if d <= max_duration), bucket_span
+            ),
+        )
+
+    def test_chug_durations(self):
+        bucket_span = 15 * 1000 // self.BUCKETS
+        durations = Chug.objects.values_list("duration_ms", flat=True)
+
+        self.assertEqual(
+            get_histogram(Chug.objects, F("duration_ms"), bucket_span, self.BUCKETS),
+            self.python_histogram(
+                (d for d in durations if d <= 15 * 1000), bucket_span
+            ),
+        )
+
+    def test_distributions(self):
+        for field in ["value_sum", "chugs"]:
+            first, ys = GamePlayerStat.get_distribution(field, all_time_season, None)
+            values = Counter(
+                GamePlayerStat.get_stats_with_player_count(
+                    all_time_season, None
+                ).values_list(field, flat=True)
+            )
+
+            self.assertEqual(first, min(values))
+            self.assertEqual(
+                ys, [values[x] for x in range(first, max(values) + 1)],
+            )
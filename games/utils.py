@@ -1,4 +1,6 @@
 import datetime
+import itertools
+from operator import itemgetter
 
 
 def get_milliseconds(td):
@@ -41,3 +43,24 @@ def format_chug_duration(ms):
 def format_total_time(s):
     td = datetime.timedelta(seconds=s)
     return str(td).split(".")[0]
+
+
+def zip_groups(rows, *grouped_rows):
+    """
+    Yields each row together with the rows of each of grouped_rows,
+    that has the same first element as the row.
+
+    Every iterable must be ordered the same way by their first element.
+    """
+    groupers = [itertools.groupby(g, key=itemgetter(0)) for g in grouped_rows]
+    pending = [next(g, None) for g in groupers]
+    for row in rows:
+        groups = []
+        for i, grouper in enumerate(groupers):
+            if pending[i] and pending[i][0] == row[0]:
+                groups.append(list(pending[i][1]))
+                pending[i] = next(grouper, None)
+            else:
+                groups.append([])
+
+        yield row, groups
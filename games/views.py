@@ -1,6 +1,8 @@
 from django.db import transaction
 from django.http import Http404, HttpResponseBadRequest
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from PIL import Image
 from rest_framework import serializers, viewsets
 from rest_framework.authentication import BaseAuthentication
@@ -13,26 +15,32 @@ from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import BasePermission, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 
+from .conditional import get_game_etag, get_live_games_etag, get_stats_etag
 from .facebook import post_game_to_page
+from .live import publish_game_update
 from .models import (
     Card,
     Chug,
     Game,
     GamePlayer,
+    GameSnapshot,
     GameToken,
     PlayerStat,
     Season,
     User,
-    update_stats_on_game_finished,
 )
 from .ranking import RANKINGS
 from .serializers import (
+    STORED_CHUG_FIELDS,
     CreateGameSerializer,
+    GameDeltaSerializer,
     GameSerializer,
     GameSerializerWithPlayerStats,
     PlayerStatSerializer,
     UserSerializer,
 )
+from .snapshots import create_game_snapshot, game_snapshot_response, get_game_snapshot
+from .tasks import process_finished_game
 
 
 class CustomAuthToken(ObtainAuthToken):
@@ -89,59 +97,111 @@ class UserViewSet(viewsets.ModelViewSet):
     permission_classes = (CreateOrAuthenticated,)
 
 
+def get_chug_fields(card_data):
+    return {
+        k[len("chug_") :]: v for k, v in card_data.items() if k in STORED_CHUG_FIELDS
+    }
+
+
+def update_chug(card, card_data):
+    if card.value != Chug.VALUE:
+        return
+
+    fields = get_chug_fields(card_data)
+    chug = getattr(card, "chug", None)
+    if chug and all(getattr(chug, k) == v for k, v in fields.items()):
+        return
+
+    Chug.objects.update_or_create(
+        id=getattr(chug, "id", None), defaults={"card": card, **fields},
+    )
+
+
+def add_cards(game, first_index, cards_data):
+    """
+    Inserts the cards and their chugs with a fixed number of queries.
+    """
+    if not cards_data:
+        return
+
+    gameplayers = list(game.ordered_gameplayers())
+    cards = Card.objects.bulk_create(
+        Card(
+            game=game,
+            value=card_data["value"],
+            suit=card_data["suit"],
+            start_delta_ms=card_data["start_delta_ms"],
+            index=i,
+            gameplayer=gameplayers[i % game.player_count],
+        )
+        for i, card_data in enumerate(cards_data, first_index)
+    )
+
+    # Not every backend returns the ids from bulk_create
+    if any(card.id is None for card in cards):
+        ids = dict(game.cards.filter(index__gte=first_index).values_list("index", "id"))
+        for card in cards:
+            card.id = ids[card.index]
+
+    Chug.objects.bulk_create(
+        Chug(card=card, **get_chug_fields(card_data))
+        for card, card_data in zip(cards, cards_data)
+        if card.value == Chug.VALUE
+    )
+
+
 def update_game(game, data):
     def update_field(key):
         if key in data:
             setattr(game, key, data[key])
 
-    chug_fields = {"chug_start_start_delta_ms", "chug_duration_ms"}
-
-    def update_chug(card, card_data):
-        if card.value == 14:
-            Chug.objects.update_or_create(
-                id=getattr(getattr(card, "chug", None), "id", None),
-                defaults={
-                    "card": card,
-                    **{
-                        k[len("chug_") :]: v
-                        for k, v in card_data.items()
-                        if k in chug_fields
-                    },
-                },
-            )
-
     game_already_ended = game.has_ended
 
-    if game.players.count() == 0:
-        for i, p_id in enumerate(data["player_ids"]):
-            GamePlayer.objects.create(
-                game=game, user=User.objects.get(id=p_id), position=i
-            )
+    if game.player_count == 0:
+        users = User.objects.in_bulk(data["player_ids"])
+        GamePlayer.objects.bulk_create(
+            GamePlayer(game=game, user=users[p_id], position=i)
+            for i, p_id in enumerate(data["player_ids"])
+        )
+        game.player_count = len(data["player_ids"])
+
+    if not game.seed:
+        game.set_seed(data["seed"])
 
     update_field("start_datetime")
-    update_field("end_datetime")
     update_field("official")
-    update_field("description")
 
-    cards = game.ordered_cards()
     new_cards = data["cards"]
 
-    last_card = cards.last()
-    previous_cards = cards.count()
-    if previous_cards > 0:
-        last_card_data = new_cards[previous_cards - 1]
-        update_chug(last_card, last_card_data)
+    last_card = game.ordered_cards().select_related("chug").last()
+    previous_cards = last_card.index + 1 if last_card else 0
+    if last_card:
+        update_chug(last_card, new_cards[previous_cards - 1])
 
-    for i, card_data in enumerate(new_cards[previous_cards:]):
-        card = Card.objects.create(
-            game=game,
-            value=card_data["value"],
-            suit=card_data["suit"],
-            start_delta_ms=card_data["start_delta_ms"],
-            index=previous_cards + i,
-        )
+    add_cards(game, previous_cards, new_cards[previous_cards:])
+
+    # The last card is resent, as its chug may have changed
+    update_game_state(game, data, game_already_ended, max(previous_cards - 1, 0))
+
+
+def update_game_delta(game, data):
+    game_already_ended = game.has_ended
 
-        update_chug(card, card_data)
+    if "last_chug" in data:
+        update_chug(data["last_card"], data["last_chug"])
+
+    add_cards(game, data["sequence"], data["cards"])
+
+    update_game_state(game, data, game_already_ended, max(data["sequence"] - 1, 0))
+
+
+def update_game_state(game, data, game_already_ended, first_updated_index):
+    def update_field(key):
+        if key in data:
+            setattr(game, key, data[key])
+
+    update_field("end_datetime")
+    update_field("description")
 
     dnf_gps = game.gameplayer_set.filter(user_id__in=data["dnf_player_ids"])
     dnf_gps.update(dnf=True)
@@ -155,8 +215,13 @@ def update_game(game, data):
 
     game.save()
 
+    # Spectators stop listening when the game ends
+    if not game_already_ended:
+        publish_game_update(game, first_updated_index)
+
     if game.has_ended and not game_already_ended:
-        update_stats_on_game_finished(game)
+        # The stats are updated in the background, not holding the game lock
+        transaction.on_commit(lambda: process_finished_game.delay(game.id))
 
 
 class OneResultSetPagination(PageNumberPagination):
@@ -171,9 +236,17 @@ class GameViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = OneResultSetPagination
     lookup_value_regex = "\\d+"
 
+    @method_decorator(condition(etag_func=get_game_etag))
     def retrieve(self, request, pk=None):
-        game = get_object_or_404(Game, pk=pk)
-        return Response(GameSerializerWithPlayerStats(game).data)
+        snapshot = get_game_snapshot(pk)
+        if snapshot is None:
+            game = get_object_or_404(Game.prefetch_cards(Game.objects), pk=pk)
+            if not game.has_ended:
+                return Response(GameSerializerWithPlayerStats(game).data)
+
+            snapshot = create_game_snapshot(game)
+
+        return game_snapshot_response(request, snapshot)
 
     def create(self, request):
         serializer = CreateGameSerializer(data=request.data)
@@ -185,14 +258,7 @@ class GameViewSet(viewsets.ReadOnlyModelViewSet):
         token = GameToken.objects.create(game=game)
         return Response({**self.serializer_class(game).data, "token": token.key})
 
-    @transaction.atomic()
-    @action(
-        detail=True,
-        methods=["post"],
-        authentication_classes=[GameUpdateAuthentication],
-        permission_classes=[GameUpdatePermission],
-    )
-    def update_state(self, request, pk=None):
+    def get_locked_game(self, request, pk):
         # Lock game object
         # Note: Doesn't do anything when using SQLite
         try:
@@ -201,10 +267,36 @@ class GameViewSet(viewsets.ReadOnlyModelViewSet):
             raise Http404("Game does not exist")
 
         self.check_object_permissions(request, game)
+        return game
+
+    @transaction.atomic()
+    @action(
+        detail=True,
+        methods=["post"],
+        authentication_classes=[GameUpdateAuthentication],
+        permission_classes=[GameUpdatePermission],
+    )
+    def update_state(self, request, pk=None):
+        game = self.get_locked_game(request, pk)
         serializer = GameSerializer(game, data=request.data)
         serializer.is_valid(raise_exception=True)
         update_game(game, serializer.validated_data)
-        return Response({})
+        return Response({"sequence": len(serializer.validated_data["cards"])})
+
+    @transaction.atomic()
+    @action(
+        detail=True,
+        methods=["post"],
+        authentication_classes=[GameUpdateAuthentication],
+        permission_classes=[GameUpdatePermission],
+    )
+    def update_state_delta(self, request, pk=None):
+        game = self.get_locked_game(request, pk)
+        serializer = GameDeltaSerializer(game, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        update_game_delta(game, data)
+        return Response({"sequence": data["sequence"] + len(data["cards"])})
 
     @action(
         detail=True,
@@ -231,6 +323,7 @@ class GameViewSet(viewsets.ReadOnlyModelViewSet):
             return HttpResponseBadRequest("image is not valid")
 
         game.image.save(None, f)
+        GameSnapshot.invalidate([game])
 
         return Response({})
 
@@ -247,10 +340,12 @@ class GameViewSet(viewsets.ReadOnlyModelViewSet):
             raise Http404("Game does not exist")
 
         game.image.delete()
+        GameSnapshot.invalidate([game])
 
         return Response({})
 
     @action(detail=False, methods=["get"], permission_classes=[])
+    @method_decorator(condition(etag_func=get_live_games_etag))
     def live_games(self, request):
         return Response(
             Game.objects.filter(end_datetime__isnull=True, dnf=False).values("id")
@@ -260,24 +355,25 @@ class GameViewSet(viewsets.ReadOnlyModelViewSet):
 class RankedFacecardsView(viewsets.ViewSet):
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
+    @method_decorator(condition(etag_func=get_stats_etag))
     def list(self, request):
         season = Season.current_season()
 
         facecards = {}
         for ranking, (suit, _) in zip(RANKINGS, Card.SUITS):
-            qs = ranking.get_qs(season)
+            entries = ranking.get_entries(season).select_related("user")
 
-            for ps, value in zip(
-                qs.exclude(user__image="")[: len(Card.FACE_CARD_VALUES)],
+            for entry, value in zip(
+                entries.exclude(user__image="")[: len(Card.FACE_CARD_VALUES)],
                 Card.FACE_CARD_VALUES,
             ):
-                user = ps.user
+                user = entry.user
                 facecards[f"{suit}-{value}"] = {
                     "user_id": user.id,
                     "user_username": user.username,
                     "user_image": user.image_url(),
                     "ranking_name": ranking.name,
-                    "ranking_value": ranking.get_value(ps),
+                    "ranking_value": ranking.format_value(entry.value),
                 }
 
         return Response(facecards)
@@ -287,6 +383,7 @@ class PlayerStatViewSet(viewsets.ViewSet):
     permission_classes = (IsAuthenticatedOrReadOnly,)
     lookup_value_regex = "\\d+"
 
+    @method_decorator(condition(etag_func=get_stats_etag))
     def retrieve(self, request, pk=None):
         user = get_object_or_404(User, pk=pk)
         stats = PlayerStat.objects.filter(user=user)
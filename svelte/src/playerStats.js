@@ -0,0 +1,69 @@
+export function divOrNull(a, b) {
+	if (a === null || !b) return null;
+	return a / b;
+}
+
+// Same as Card.finish_start_delta_ms
+export function getFinishStartDeltaMs(card) {
+	if (card.value === 14) {
+		if (!card.chug_duration_ms) return null;
+		const chugStart = card.chug_start_start_delta_ms || card.start_delta_ms;
+		return chugStart + card.chug_duration_ms;
+	}
+
+	return card.start_delta_ms;
+}
+
+// Same as Game.get_player_stats, as the live updates don't include the player stats,
+// see PlayerStatsScriptTest
+export function getPlayerStats(data) {
+	const n = data.player_stats.length;
+	const cards = data.cards;
+	const totalSips = new Array(n).fill(0);
+	const totalDrawn = new Array(n).fill(0);
+	let lastSip = null;
+	cards.forEach((c, i) => {
+		totalSips[i % n] += c.value;
+		totalDrawn[i % n] += 1;
+		lastSip = [i % n, c.value];
+	});
+
+	let totalTimes = new Array(n).fill(null);
+	let totalDone = new Array(n).fill(null);
+	if (cards.length > 0 && cards[0].start_delta_ms) {
+		totalTimes = new Array(n).fill(0);
+		totalDone = new Array(n).fill(0);
+		let prevFinishStartDeltaMs = 0;
+		for (let i = 0; i < cards.length; i++) {
+			const finishStartDeltaMs = getFinishStartDeltaMs(cards[i]);
+			if (finishStartDeltaMs === null) break;
+
+			totalTimes[i % n] += finishStartDeltaMs - prevFinishStartDeltaMs;
+			totalDone[i % n] += 1;
+			prevFinishStartDeltaMs = finishStartDeltaMs;
+		}
+	}
+
+	return data.player_stats.map((ps, i) => {
+		let timePerSip;
+		if (!data.start_datetime) {
+			timePerSip = null;
+		} else if (lastSip && lastSip[0] === i && !data.end_datetime) {
+			timePerSip = divOrNull(totalTimes[i], totalSips[i] - lastSip[1]);
+		} else {
+			timePerSip = divOrNull(totalTimes[i], totalSips[i]);
+		}
+
+		return {
+			...ps,
+			dnf: data.dnf_player_ids.includes(ps.id),
+			total_sips: totalSips[i],
+			sips_per_turn: divOrNull(totalSips[i], totalDrawn[i]),
+			full_beers: Math.floor(totalSips[i] / data.sips_per_beer),
+			extra_sips: totalSips[i] % data.sips_per_beer,
+			total_time: totalTimes[i],
+			time_per_turn: divOrNull(totalTimes[i], totalDone[i]),
+			time_per_sip: timePerSip,
+		};
+	});
+}
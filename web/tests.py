@@ -1,8 +1,25 @@
-from django.test import Client, TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
-from games.models import Card, Chug, Game, GamePlayer, User
+from games.models import (
+    Card,
+    Chug,
+    DailyGameCount,
+    Game,
+    GamePlayer,
+    User,
+    bump_stats_version,
+)
 from games.utils import get_milliseconds
+from web.views import (
+    StatsView,
+    get_bad_chugger_candidates,
+    get_index_totals,
+    get_recent_player_candidates,
+)
 
 
 class GameViewTest(TestCase):
@@ -30,6 +47,7 @@ class GameViewTest(TestCase):
             if value == 14:
                 Chug.objects.create(card=card, duration_ms=12345)
 
+        self.game.assign_card_players()
         self.game.end_datetime = timezone.now()
         self.game.save()
 
@@ -65,9 +83,110 @@ class GameViewTest(TestCase):
         self.game.save()
         self.assert_can_render_pages()
 
+    def test_index(self):
+        User.objects.filter(id=self.player1.id).update(image="user_images/1.png")
+        Chug.objects.update(duration_ms=25 * 1000)
+
+        self.assertEqual(
+            [u for u, _ in get_recent_player_candidates(10)], [self.player1]
+        )
+        self.assertEqual([u for u, _ in get_bad_chugger_candidates(10)], [self.player1])
+
+        r = self.client.get(f"/")
+        self.assertEqual(r.status_code, 200)
+
+    def test_index_totals_include_all_games(self):
+        Game.objects.filter(id=self.game.id).update(player_count=2)
+        for end_datetime, dnf in [(timezone.now(), False), (None, True)]:
+            game = Game.objects.create(
+                start_datetime=timezone.now(),
+                end_datetime=end_datetime,
+                dnf=dnf,
+                player_count=1,
+            )
+            GamePlayer.objects.create(game=game, user=self.player1, position=0)
+        DailyGameCount.recalculate_all()
+
+        self.assertEqual(
+            get_index_totals(),
+            {
+                "total_games": Game.objects.count(),
+                "total_players": GamePlayer.objects.count(),
+            },
+        )
+
+    def get_game_list_query_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            r = self.client.get(f"/games/")
+            self.assertEqual(r.status_code, 200)
+
+        return len(queries)
+
+    def test_game_list_query_count_is_constant(self):
+        # The first request also stores the default constance values
+        self.get_game_list_query_count()
+        query_count = self.get_game_list_query_count()
+
+        for i in range(3):
+            game = Game.objects.create(start_datetime=timezone.now(), dnf=i > 0)
+            GamePlayer.objects.create(game=game, user=self.player1, position=0)
+            GamePlayer.objects.create(game=game, user=self.player2, position=1)
+            Card.objects.create(game=game, index=0, value=2, suit="S")
+
+        self.assertEqual(self.get_game_list_query_count(), query_count)
+
 
 class StatsViewTest(TestCase):
+    def setUp(self):
+        # The stats version starts over in every test
+        cache.clear()
+
     def test_with_no_games(self):
         client = Client()
         r = client.get(f"/stats/")
         self.assertEqual(r.status_code, 200)
+
+    def get_stats_query_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            r = Client().get(f"/stats/")
+            self.assertEqual(r.status_code, 200)
+
+        return len(queries)
+
+    def test_stats_cached_until_version_bumped(self):
+        # The first request also stores the default constance values
+        self.get_stats_query_count()
+        bump_stats_version()
+
+        uncached_query_count = self.get_stats_query_count()
+        self.assertLess(self.get_stats_query_count(), uncached_query_count)
+
+        bump_stats_version()
+        self.assertEqual(self.get_stats_query_count(), uncached_query_count)
+
+    def test_stats_not_modified_until_version_bumped(self):
+        client = Client()
+        etag = client.get(f"/stats/")["ETag"]
+
+        r = client.get(f"/stats/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 304)
+
+        bump_stats_version()
+        r = client.get(f"/stats/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r["ETag"], etag)
+
+
+class StatsDistributionTest(SimpleTestCase):
+    def test_chug_table_rows_sum_to_one(self):
+        for row in StatsView.get_chug_table():
+            self.assertAlmostEqual(sum(p for p in row[1:] if p is not None), 100)
+
+    def test_sips_distribution_is_evaluated_per_player_count(self):
+        dist, dist_strs = StatsView.sips_count_distribution([2, 6])
+        probs = dist(range(200))
+
+        self.assertEqual(probs.shape, (2, 200))
+        self.assertEqual(len(dist_strs), 2)
+        for row in probs:
+            self.assertAlmostEqual(row.sum(), 1, places=3)
@@ -1,10 +1,9 @@
 import datetime
 import random
-import re
-from collections import Counter
-from math import sqrt
+from functools import lru_cache
 from urllib.parse import urlencode
 
+import numpy as np
 from django.contrib import messages
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -16,6 +15,7 @@ from django.contrib.auth.views import (
     PasswordResetDoneView,
     PasswordResetView,
 )
+from django.core.cache import cache
 from django.core.files import File
 from django.core.mail import mail_admins
 from django.core.paginator import Paginator
@@ -25,14 +25,20 @@ from django.db.models import (
     DateTimeField,
     F,
     IntegerField,
+    OuterRef,
+    Q,
+    Subquery,
     Sum,
     Value,
     When,
 )
+from django.db.models.functions import Coalesce
 from django.shortcuts import render
 from django.templatetags.static import static
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.views.generic import (
     CreateView,
     DetailView,
@@ -40,24 +46,30 @@ from django.views.generic import (
     TemplateView,
     UpdateView,
 )
-from scipy.stats import hypergeom, norm
 
 from games.achievements import ACHIEVEMENTS
+from games.conditional import get_stats_etag
+from games.histogram import duration_microseconds, get_histogram
 from games.models import (
     Card,
     Chug,
+    DailyGameCount,
     Game,
     GamePlayer,
     GamePlayerStat,
     OneTimePassword,
+    PlayedWithCount,
     User,
+    UserAchievement,
     all_time_season,
     filter_season,
     filter_season_and_player_count,
+    get_stats_version,
 )
-from games.ranking import RANKINGS, get_ranking_from_key
+from games.ranking import RANKINGS, get_ranking_from_key, get_ranks
+from games.search import search_games
 from games.serializers import GameSerializerWithPlayerStats, UserSerializer
-from games.utils import get_milliseconds
+from games.snapshots import get_or_create_game_snapshot, load_game_snapshot
 
 from .forms import FailedGameUploadForm, UserSettingsForm
 from .models import FailedGameUpload
@@ -73,9 +85,16 @@ from .utils import (
 
 RANKING_PAGE_LIMIT = 15
 
+# The samplers and totals on the index page may be this old
+INDEX_CACHE_TIMEOUT = 60
 
-def get_ranking_url(ranking, user, season):
-    rank = ranking.get_rank(user, season)
+BAD_CHUG_MS = 20 * 1000
+
+# Only as a fallback, as the cached stats are invalidated by get_stats_version
+STATS_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def get_ranking_url(ranking, rank, season):
     if rank is None:
         return None
 
@@ -85,57 +104,123 @@ def get_ranking_url(ranking, user, season):
     )
 
 
-def get_recent_players(n, min_sample_size=10):
-    recent_players = {}
-    for game in Game.objects.order_by(F("end_datetime").desc(nulls_last=True)):
-        for p in game.players.all():
-            if p in recent_players or not p.image:
-                continue
+def get_recent_player_candidates(count):
+    """
+    Returns the players with an image, who most recently played a game,
+    along with a description of that game.
+    """
+    last_gameplayers = GamePlayer.objects.filter(user=OuterRef("pk")).order_by(
+        F("game__end_datetime").desc(nulls_last=True), "-game_id"
+    )
+    users = list(
+        User.objects.exclude(Q(image="") | Q(image__isnull=True))
+        .annotate(
+            last_game_id=Subquery(last_gameplayers.values("game_id")[:1]),
+            last_game_end_datetime=Subquery(
+                last_gameplayers.values("game__end_datetime")[:1]
+            ),
+        )
+        .filter(last_game_id__isnull=False)
+        .order_by(F("last_game_end_datetime").desc(nulls_last=True), "-last_game_id")[
+            :count
+        ]
+    )
 
-            recent_players[
-                p
-            ] = f"For playing game on {game.date} with {game.players_str()}"
+    games = Game.prefetch_gameplayers(Game.objects).in_bulk(
+        [u.last_game_id for u in users]
+    )
+    return [
+        (
+            u,
+            f"For playing game on {games[u.last_game_id].date} "
+            f"with {games[u.last_game_id].players_str()}",
+        )
+        for u in users
+    ]
 
-        if len(recent_players) >= min_sample_size:
-            break
 
-    recent_players = random.sample(recent_players.items(), min(n, len(recent_players)))
-    random.shuffle(recent_players)
-    return recent_players
+def get_bad_chugger_candidates(count):
+    """
+    Returns the players with an image, who most recently had a slow chug,
+    along with a description of that chug.
+    """
+    last_bad_chugs = Chug.objects.filter(
+        duration_ms__gte=BAD_CHUG_MS, card__gameplayer__user=OuterRef("pk")
+    ).order_by(F("card__game__start_datetime").desc(nulls_last=True), "-id")
+    users = list(
+        User.objects.exclude(Q(image="") | Q(image__isnull=True))
+        .annotate(
+            last_bad_chug_id=Subquery(last_bad_chugs.values("id")[:1]),
+            last_bad_chug_start_datetime=Subquery(
+                last_bad_chugs.values("card__game__start_datetime")[:1]
+            ),
+        )
+        .filter(last_bad_chug_id__isnull=False)
+        .order_by(
+            F("last_bad_chug_start_datetime").desc(nulls_last=True),
+            "-last_bad_chug_id",
+        )[:count]
+    )
 
+    chugs = Chug.objects.select_related("card__game").in_bulk(
+        [u.last_bad_chug_id for u in users]
+    )
+    return [
+        (
+            u,
+            f"For chugging an ace in {chugs[u.last_bad_chug_id].duration_ms / 1000} "
+            f"seconds on {chugs[u.last_bad_chug_id].card.game.date}",
+        )
+        for u in users
+    ]
 
-def get_bad_chuggers(n, min_sample_size=10):
-    bad_chuggers = {}
-    for chug in Chug.objects.filter(duration_ms__gte=20 * 1000).order_by(
-        F("card__game__start_datetime").desc(nulls_last=True)
-    ):
-        u = chug.card.get_user()
-        if u in bad_chuggers or not u.image:
-            continue
 
-        bad_chuggers[
-            u
-        ] = f"For chugging an ace in {chug.duration_ms / 1000} seconds on {chug.card.game.date}"
+def sample_candidates(key, get_candidates, n, min_sample_size):
+    candidates = cache.get_or_set(
+        key, lambda: get_candidates(min_sample_size), INDEX_CACHE_TIMEOUT
+    )
+    candidates = random.sample(candidates, min(n, len(candidates)))
+    random.shuffle(candidates)
+    return candidates
+
+
+def get_recent_players(n, min_sample_size=10):
+    return sample_candidates(
+        "index:recent_players", get_recent_player_candidates, n, min_sample_size
+    )
 
-        if len(bad_chuggers) >= min_sample_size:
-            break
 
-    bad_chuggers = random.sample(bad_chuggers.items(), min(n, len(bad_chuggers)))
-    random.shuffle(bad_chuggers)
-    return bad_chuggers
+def get_bad_chuggers(n, min_sample_size=10):
+    return sample_candidates(
+        "index:bad_chuggers", get_bad_chugger_candidates, n, min_sample_size
+    )
+
+
+def get_index_totals():
+    """
+    Returns the total number of games, including DNF and live games,
+    and of players in them.
+    The completed games are counted by DailyGameCount,
+    so only the few games without an end are counted here.
+    """
+    totals = DailyGameCount.get_totals()
+    not_completed = Game.objects.filter(end_datetime__isnull=True).aggregate(
+        total_games=Count("id"), total_players=Coalesce(Sum("player_count"), 0),
+    )
+    return {key: totals[key] + not_completed[key] for key in totals}
 
 
 def index(request):
     BEERS_PER_PLAYER = sum(range(2, 15)) / Game.STANDARD_SIPS_PER_BEER
-    total_players = GamePlayer.objects.count()
+    totals = cache.get_or_set("index:totals", get_index_totals, INDEX_CACHE_TIMEOUT)
 
     context = {
-        "total_beers": total_players * BEERS_PER_PLAYER,
-        "total_games": Game.objects.all().count(),
+        "total_beers": totals["total_players"] * BEERS_PER_PLAYER,
+        "total_games": totals["total_games"],
         "recent_players": get_recent_players(4),
         "wall_of_shame_players": get_bad_chuggers(4),
-        "live_games": Game.objects.filter(
-            end_datetime__isnull=True, dnf=False
+        "live_games": Game.prefetch_gameplayers(
+            Game.objects.filter(end_datetime__isnull=True, dnf=False)
         ).order_by("-start_datetime")[:5],
     }
     return render(request, "index.html", context)
@@ -212,19 +297,7 @@ class GameListView(PaginatedListView):
         season = SeasonChooser(self.request).current
         qs = filter_season(Game.objects, season, should_include_live=True)
 
-        query = self.request.GET.get("query", "")
-        parts = re.split(r"[\s,]", query)
-        for part in parts:
-            part = part.strip()
-            if part != "":
-                if part[0] == "#":
-                    # Filter by hashtag in description
-                    qs = qs.filter(description__icontains=part)
-                else:
-                    # Filter by username
-                    qs = qs.filter(players__username__icontains=part)
-
-        qs = qs.distinct()
+        qs = search_games(qs, self.request.GET.get("query", ""))
 
         if self.order.current_column == "end_datetime":
             # First show live games (but not dnf games),
@@ -254,7 +327,7 @@ class GameListView(PaginatedListView):
             else:
                 qs = qs.order_by(F("duration").asc(nulls_last=True))
 
-        return qs
+        return Game.prefetch_list_data(qs)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -267,12 +340,20 @@ class GameDetailView(DetailView):
     model = Game
     template_name = "game_detail.html"
 
+    def get_game_data(self):
+        snapshot = get_or_create_game_snapshot(self.object)
+        if snapshot:
+            return load_game_snapshot(snapshot)
+
+        game = Game.prefetch_cards(Game.objects).get(id=self.object.id)
+        return GameSerializerWithPlayerStats(game).data
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["game_data"] = GameSerializerWithPlayerStats(self.object).data
+        context["game_data"] = self.get_game_data()
         context["ordered_gameplayers"] = [
             {"dnf": gp.dnf, "user": UserSerializer(gp.user).data}
-            for gp in self.object.ordered_gameplayers()
+            for gp in self.object.ordered_gameplayers_with_users()
         ]
         context["card_constants"] = {
             "value_names": dict(Card.VALUES),
@@ -300,7 +381,7 @@ class PlayerListView(PaginatedListView):
         return context
 
 
-def games_heatmap_data(games, season):
+def games_heatmap_data(season, user=None, player_count=None):
     if season == all_time_season:
         last_date = timezone.now().date()
         first_date = last_date - datetime.timedelta(days=53 * 7 - 1)
@@ -308,10 +389,9 @@ def games_heatmap_data(games, season):
         last_date = season.end_datetime.date()
         first_date = season.start_datetime.date()
 
-    games_played = Counter()
-    for g in filter_season(games, season):
-        if g.end_datetime:
-            games_played[g.end_datetime.date()] += 1
+    games_played = DailyGameCount.get_counts(
+        first_date, last_date, user=user, player_count=player_count
+    )
 
     weekday = last_date.weekday()
 
@@ -349,7 +429,7 @@ def games_heatmap_data(games, season):
                 categories.append("")
 
         if date >= first_date:
-            played = games_played[date]
+            played = games_played.get(date, 0)
         else:
             played = None
 
@@ -365,6 +445,15 @@ def games_heatmap_data(games, season):
     }
 
 
+def get_player_etag(request, pk):
+    # The one time password shown to the player and staff changes when it is used
+    if request.user.id == pk or request.user.is_staff:
+        return None
+
+    return get_stats_etag(request)
+
+
+@method_decorator(condition(etag_func=get_player_etag), name="dispatch")
 class PlayerDetailView(DetailView):
     model = User
     template_name = "player_detail.html"
@@ -377,43 +466,46 @@ class PlayerDetailView(DetailView):
         season = SeasonChooser(self.request).current
         context["stats"] = self.object.stats_for_season(season)
 
+        achieved_keys = set(
+            UserAchievement.objects.filter(user=self.object).values_list(
+                "key", flat=True
+            )
+        )
         context["achievements"] = []
         for achievement in ACHIEVEMENTS:
             context["achievements"].append(
                 {
-                    "achieved": achievement.has_achieved(self.object),
+                    "achieved": achievement.key in achieved_keys,
                     "name": achievement.name,
                     "description": achievement.description,
                     "icon_url": static(f"achievements/{achievement.icon}.svg"),
                 }
             )
 
+        ranks = get_ranks(self.object, season)
         context["rankings"] = []
         for ranking in RANKINGS:
+            rank = ranks[ranking.key]
             context["rankings"].append(
                 {
                     "name": ranking.name,
-                    "rank": ranking.get_rank(self.object, season),
-                    "url": get_ranking_url(ranking, self.object, season),
+                    "rank": rank,
+                    "url": get_ranking_url(ranking, rank, season),
                 }
             )
 
-        context["heatmap_data"] = games_heatmap_data(self.object.games.all(), season)
+        context["heatmap_data"] = games_heatmap_data(season, user=self.object)
 
         if self.object == self.request.user or self.request.user.is_staff:
             otp, _ = OneTimePassword.objects.get_or_create(user=self.object)
             context["otp_data"] = otp.password
 
-        played_with_count = Counter()
-        for game in self.object.games.all():
-            for player in game.players.all():
-                if player != self.object:
-                    played_with_count[player.username] += 1
-
-        context["played_with_data"] = sorted(
-            ({"x": k, "y": v} for k, v in played_with_count.items()),
-            key=lambda x: -x["y"],
-        )[:30]
+        context["played_with_data"] = [
+            {"x": username, "y": count}
+            for username, count in PlayedWithCount.get_counts(
+                self.object, all_time_season, limit=30
+            )
+        ]
 
         return context
 
@@ -448,6 +540,7 @@ class UserSettingsView(LoginRequiredMixin, UpdateView):
         return super().form_valid(form)
 
 
+@method_decorator(condition(etag_func=get_stats_etag), name="dispatch")
 class RankingView(PaginatedListView):
     template_name = "ranking.html"
     page_limit = RANKING_PAGE_LIMIT
@@ -459,7 +552,7 @@ class RankingView(PaginatedListView):
     def get_queryset(self):
         ranking_type = self.request.GET.get("type")
         ranking = get_ranking_from_key(ranking_type) or RANKINGS[0]
-        return ranking.get_qs(self.season)
+        return ranking.get_entries(self.season).select_related("user", "game")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -469,17 +562,13 @@ class RankingView(PaginatedListView):
         ranking = ranking_chooser.current
 
         object_list = context["object_list"]
-        start_index = object_list.start_index()
-        for i, o in enumerate(object_list):
-            o.rank = start_index + i
-            o.value = ranking.get_value(o)
-            o.game = ranking.get_game(o)
+        for o in object_list:
+            o.value = ranking.format_value(o.value)
 
         if self.request.user.is_authenticated:
-            context["user_rank"] = ranking.get_rank(self.request.user, self.season)
-            context["user_rank_url"] = get_ranking_url(
-                ranking, self.request.user, self.season
-            )
+            user_rank = ranking.get_rank(self.request.user, self.season)
+            context["user_rank"] = user_rank
+            context["user_rank_url"] = get_ranking_url(ranking, user_rank, self.season)
 
         return context
 
@@ -489,11 +578,14 @@ CARD_MEAN = SIPS_MEAN / 13
 SIPS_VAR = sum((CARD_MEAN - i) ** 2 for i in range(2, 14 + 1))
 
 
+@method_decorator(condition(etag_func=get_stats_etag), name="dispatch")
 class StatsView(TemplateView):
     template_name = "stats.html"
 
+    PLAYER_COUNTS = np.arange(2, 6 + 1)
+
     @classmethod
-    def sips_count_distribution(cls, player_count):
+    def sips_count_distribution(cls, player_counts):
         """
         Approximate probability of getting exactly x sips.
 
@@ -503,39 +595,71 @@ class StatsView(TemplateView):
         Futhermore a continuity correction is used.
 
         See https://math.stackexchange.com/a/1300566/19750
+
+        Returns a function giving the probabilities of an array of xs
+        for every player count, and a description for every player count.
         """
+        # scipy is slow to import, so only import it when needed
+        from scipy.stats import norm
+
+        player_counts = np.asarray(player_counts)
         mean = SIPS_MEAN + 0.5
-        total_cards = 13 * player_count
+        total_cards = 13 * player_counts
         fpc = (total_cards - 13) / (total_cards - 1)
         var = SIPS_VAR * fpc
-        return norm(mean, sqrt(var)).pdf, f"N({mean}, {var:.2f})"
+        return (
+            lambda xs: norm.pdf(np.asarray(xs)[None, :], mean, np.sqrt(var)[:, None]),
+            [f"N({mean}, {v:.2f})" for v in var],
+        )
 
     @classmethod
-    def chug_count_distribution(cls, player_count):
+    def chug_count_distribution(cls, player_counts):
         # Exact probability
-        N = 13 * player_count
-        K = player_count
+        from scipy.stats import hypergeom
+
+        player_counts = np.asarray(player_counts)
+        N = 13 * player_counts
+        K = player_counts
         n = 13
-        rv = hypergeom(N, K, n)
-        return rv.pmf, f"HyperGeometric({N}, {K}, {n})"
+        return (
+            lambda xs: hypergeom.pmf(
+                np.asarray(xs)[None, :], N[:, None], K[:, None], n
+            ),
+            [f"HyperGeometric({N_i}, {K_i}, {n})" for N_i, K_i in zip(N, K)],
+        )
 
     @classmethod
     def combined_distribution(cls, season, dist_f):
-        ds = []
-        ws = []
-        for player_count in range(2, 6 + 1):
-            ds.append(dist_f(player_count))
-            ws.append(
-                GamePlayerStat.get_stats_with_player_count(season, player_count).count()
-            )
-
-        total_ws = sum(ws)
+        counts = dict(
+            GamePlayerStat.get_stats_with_player_count(season, None)
+            .order_by()
+            .values_list("gameplayer__game__player_count")
+            .annotate(Count("id"))
+        )
+        ws = np.array([counts.get(pc, 0) for pc in cls.PLAYER_COUNTS.tolist()])
+        ws = ws / ws.sum()
 
+        dist, dist_strs = dist_f(cls.PLAYER_COUNTS)
         return (
-            lambda x: sum(d[0](x) * w / total_ws for d, w in zip(ds, ws)),
-            "\n" + " + \n".join(f"{w / total_ws:.2f} * {d[1]}" for d, w in zip(ds, ws)),
+            lambda xs: ws @ dist(xs),
+            "\n" + " + \n".join(f"{w:.2f} * {d}" for d, w in zip(dist_strs, ws)),
         )
 
+    @classmethod
+    @lru_cache(maxsize=None)
+    def get_chug_table(cls):
+        # Doesn't depend on the games
+        dist, _ = cls.chug_count_distribution(cls.PLAYER_COUNTS)
+        chug_counts = range(6 + 1)
+        probs = dist(chug_counts) * 100
+        return [
+            [
+                pcount,
+                *(p if chugs <= pcount else None for chugs, p in zip(chug_counts, row)),
+            ]
+            for pcount, row in zip(cls.PLAYER_COUNTS.tolist(), probs.tolist())
+        ]
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         season = SeasonChooser(self.request).current
@@ -544,6 +668,28 @@ class StatsView(TemplateView):
         context["player_count_chooser"] = chooser
         player_count = chooser.current
 
+        context.update(self.get_cached_stats_data(season, player_count))
+        return context
+
+    @classmethod
+    def get_cached_stats_data(cls, season, player_count):
+        """
+        The stats only change when games finish, which bumps the stats version,
+        so they are cached with the stats version as the key version.
+        """
+        key = f"stats:{season.number}:{player_count}"
+        version = get_stats_version()
+        data = cache.get(key, version=version)
+        if data is None:
+            data = cls.get_stats_data(season, player_count)
+            cache.set(key, data, STATS_CACHE_TIMEOUT, version=version)
+
+        return data
+
+    @classmethod
+    def get_stats_data(cls, season, player_count):
+        data = {}
+
         games = filter_season_and_player_count(Game.objects, season, player_count)
 
         total_sips = (
@@ -559,7 +705,7 @@ class StatsView(TemplateView):
             "total_duration"
         ] or datetime.timedelta(0)
 
-        context["game_stats"] = {
+        data["game_stats"] = {
             "total_games": games.count(),
             "total_dnf": games.filter(dnf=True).count(),
             "total_sips": total_sips,
@@ -567,45 +713,37 @@ class StatsView(TemplateView):
             "total_duration": str(round_timedelta(total_duration)),
         }
 
-        games_played = Counter()
-        for g in games.all():
-            if g.end_datetime:
-                games_played[g.end_datetime.date()] += 1
-
-        context["heatmap_data"] = games_heatmap_data(games, season)
+        data["heatmap_data"] = games_heatmap_data(season, player_count=player_count)
 
         stat_types = {
             "sips_data": (
                 GamePlayerStat.get_sips_distribution(season, player_count),
-                self.sips_count_distribution,
+                cls.sips_count_distribution,
             ),
             "chugs_data": (
                 GamePlayerStat.get_chugs_distribution(season, player_count),
-                self.chug_count_distribution,
+                cls.chug_count_distribution,
             ),
         }
 
-        for name, (stats, prob_f) in stat_types.items():
+        for name, ((first, ys), prob_f) in stat_types.items():
             xs = []
-            ys = []
             probs = []
             dist_str = None
-            if stats.exists():
-                d = {s["value"]: s["value__count"] for s in stats}
+            if ys:
                 if prob_f:
                     if player_count == None:
-                        dist, dist_str = self.combined_distribution(season, prob_f)
+                        dist, dist_str = cls.combined_distribution(season, prob_f)
                     else:
-                        dist, dist_str = prob_f(player_count)
+                        player_dist, dist_strs = prob_f([player_count])
+                        dist = lambda xs: player_dist(xs)[0]
+                        dist_str = dist_strs[0]
 
-                for x in range(stats.first()["value"], stats.last()["value"] + 1):
-                    xs.append(x)
-                    ys.append(d.get(x, 0))
+                xs = list(range(first, first + len(ys)))
+                if dist:
+                    probs = dist(xs).tolist()
 
-                    if dist:
-                        probs.append(dist(x))
-
-            context[name] = {
+            data[name] = {
                 "xs": xs,
                 "ys": ys,
                 "total_ys": sum(ys),
@@ -623,24 +761,18 @@ class StatsView(TemplateView):
                 "name": "duration_data",
                 "max_duration": 4,
                 "max_duration_unit": "hours",
-                "durations": lambda max_duration: (
-                    g["duration"]
-                    for g in games_with_durations.filter(
-                        dnf=False, duration__lte=max_duration
-                    ).values("duration")
-                ),
+                "qs": games.filter(dnf=False),
+                "value": duration_microseconds("start_datetime", "end_datetime"),
+                "unit": datetime.timedelta(microseconds=1),
                 "format": str,
             },
             {
                 "name": "chug_duration_data",
                 "max_duration": 15,
                 "max_duration_unit": "seconds",
-                "durations": lambda max_duration: (
-                    datetime.timedelta(milliseconds=c["duration_ms"])
-                    for c in chugs.filter(
-                        duration_ms__lte=get_milliseconds(max_duration)
-                    ).values("duration_ms")
-                ),
+                "qs": chugs,
+                "value": F("duration_ms"),
+                "unit": datetime.timedelta(milliseconds=1),
                 "format": lambda td: f"{td.total_seconds():.2f}",
             },
         ]
@@ -650,34 +782,25 @@ class StatsView(TemplateView):
                 **{d["max_duration_unit"]: d["max_duration"]}
             )
             bucket_span = max_duration / BUCKETS
-            occurrences = Counter()
-            for duration in d["durations"](max_duration):
-                x = int(duration / bucket_span)
-                occurrences[x] += 1
+            ys = get_histogram(d["qs"], d["value"], bucket_span // d["unit"], BUCKETS)
 
-            context[d["name"]] = {
-                "total_ys": sum(occurrences.values()),
+            data[d["name"]] = {
+                "total_ys": sum(ys),
                 "bucket_span_seconds": bucket_span.total_seconds(),
                 "max_duration": f"{d['max_duration']} {d['max_duration_unit']}",
                 "xs": [d["format"]((i + 1) * bucket_span) for i in range(BUCKETS)],
-                "ys": [occurrences[i] for i in range(BUCKETS)],
+                "ys": ys,
             }
 
-        context["chug_table_header"] = ["Players\xa0\\\xa0Chugs", *range(6 + 1)]
-        context["chug_table"] = []
-        for pcount in range(2, 6 + 1):
-            row = [pcount]
-            context["chug_table"].append(row)
-            dist, _ = self.chug_count_distribution(pcount)
-            for chugs in range(6 + 1):
-                row.append(dist(chugs) * 100 if chugs <= pcount else None)
+        data["chug_table_header"] = ["Players\xa0\\\xa0Chugs", *range(6 + 1)]
+        data["chug_table"] = cls.get_chug_table()
 
-        context["location_data"] = []
+        data["location_data"] = []
         for g in games.filter(
             location_latitude__isnull=False, location_accuracy__lte=100 * 1000
         ):
             game_url = reverse("game_detail", args=[g.id])
-            context["location_data"].append(
+            data["location_data"].append(
                 {
                     "latitude": g.location_latitude,
                     "longitude": g.location_longitude,
@@ -685,7 +808,7 @@ class StatsView(TemplateView):
                 }
             )
 
-        return context
+        return data
 
 
 class FailedGameUploadView(CreateView):